@@ -182,8 +182,8 @@ SIMPLE_HISTORY_REVERT_DISABLED = True
 
 # REDIS connection
 # REDIS_HOST = "0.0.0.0"
-REDIS_HOST = "127.0.0.1"
-REDIS_PORT = "6379"
+REDIS_HOST = env.str("REDIS_HOST", "127.0.0.1")
+REDIS_PORT = env.str("REDIS_PORT", "6379")
 
 # Celery connection
 CELERY_BROKER_URL = "redis://" + REDIS_HOST + ":" + REDIS_PORT + "/0"
@@ -192,14 +192,55 @@ CELERY_RESULT_BACKEND = "redis://" + REDIS_HOST + ":" + REDIS_PORT + "/0"
 CELERY_ACCEPT_CONTENT = ["application/json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
+CELERY_BEAT_SCHEDULE = {
+    # Retries notifications that were not delivered right after the commit
+    "dispatch-notification-outbox": {
+        "task": "vacation.tasks.dispatch_notification_outbox",
+        "schedule": 60.0,
+    },
+}
+
+# Year-end rollover: rows processed per transaction and the pause between
+# chunks that lets other writers take the database lock
+VACATION_ROLLOVER_CHUNK_SIZE = env.int("VACATION_ROLLOVER_CHUNK_SIZE", 500)
+VACATION_ROLLOVER_PAUSE = env.float("VACATION_ROLLOVER_PAUSE", 0.05)
+
+# Number of weekends the duty roster is planned ahead
+DUTY_ROSTER_WEEKS_AHEAD = env.int("DUTY_ROSTER_WEEKS_AHEAD", 4)
+
+# Share of a job title that may be away at the same time
+TEAM_CAPACITY_THRESHOLD = env.float("TEAM_CAPACITY_THRESHOLD", 0.4)
+
+# Cache configuration, the local memory cache is used by default (dev, tests)
+CACHES = {
+    "default": {
+        "BACKEND": env.str(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": env.str("CACHE_LOCATION", ""),
+    }
+}
+
+# Lifetime of the API tokens issued to the bot, in seconds
+TELEGRAM_API_TOKEN_MAX_AGE = env.int("TELEGRAM_API_TOKEN_MAX_AGE", 3600)
+
+# Seconds the leave request changes cursor stays behind the current time,
+# longer than a transaction saving a leave request may take to commit
+CHANGES_CURSOR_LAG = env.int("CHANGES_CURSOR_LAG", 60)
 
 # DRF configuration
 REST_FRAMEWORK = {
+    # Bot requests carry a signed token, the site uses the session
+    "DEFAULT_AUTHENTICATION_CLASSES": [
+        "staff.authentication.TelegramTokenAuthentication",
+        "rest_framework.authentication.SessionAuthentication",
+        "rest_framework.authentication.BasicAuthentication",
+    ],
     # Use Django's standard `django.contrib.auth` permissions,
     # or allow read-only access for unauthenticated users.
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly"
-    ]
+    ],
 }
 
 # AllAuth configuration
@@ -0,0 +1,88 @@
+import threading
+import time
+import zlib
+from typing import Any, Callable
+
+from django.core.cache import cache
+
+from common.logger import logger
+
+# A fixed pool of striped locks keeps at most one thread per process
+# computing the same key without growing a lock per cache key.
+_LOCK_STRIPES = 64
+_process_locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+
+_MISSING = object()
+
+
+def _process_lock(key: str) -> threading.Lock:
+    """Return the in-process lock guarding the given cache key."""
+    return _process_locks[zlib.crc32(key.encode()) % _LOCK_STRIPES]
+
+
+def get_namespace_version(namespace: str) -> int:
+    """
+    Return the current version of a cache namespace.
+    Versions start from a timestamp so that a namespace evicted from the cache
+    never comes back with a version that was already used.
+    """
+    key = f"{namespace}:version"
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key, 0)
+    return version
+
+
+def bump_namespace_version(namespace: str) -> None:
+    """Invalidate every key built from the namespace version."""
+    key = f"{namespace}:version"
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The version is not in the cache yet, so nothing was cached under it
+        get_namespace_version(namespace)
+
+
+def get_or_set_single_flight(
+    key: str,
+    producer: Callable[[], Any],
+    timeout: int,
+    lock_timeout: int = 30,
+    wait_timeout: float = 5.0,
+    poll_interval: float = 0.05,
+) -> Any:
+    """
+    Return the cached value for the key or compute it with the producer.
+    On a miss only one caller computes the value: threads of the same process
+    wait on a local lock and other processes poll the cache while a shared
+    lock key is held. If the computing caller does not finish in time,
+    the waiting caller computes the value itself.
+    """
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+
+    with _process_lock(key):
+        value = cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        lock_key = f"{key}:lock"
+        if cache.add(lock_key, 1, timeout=lock_timeout):
+            try:
+                value = producer()
+                cache.set(key, value, timeout=timeout)
+            finally:
+                cache.delete(lock_key)
+            return value
+
+        deadline = time.monotonic() + wait_timeout
+        while time.monotonic() < deadline:
+            time.sleep(poll_interval)
+            value = cache.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+
+    logger.warning("Timed out waiting for cache key %s, computing it", key)
+    return producer()
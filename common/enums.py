@@ -11,6 +11,20 @@ class StatusRequestChoices(models.TextChoices):
     SAVED = "saved", _("Saved")
 
 
+class RolloverStageChoices(models.TextChoices):
+    BALANCES = "balances", _("Opening balances")
+    EXPIRE = "expire", _("Expiring requests")
+    DONE = "done", _("Done")
+
+
+class OutboxStatusChoices(models.TextChoices):
+    """The choices for the status of an outgoing notification."""
+
+    PENDING = "pending", _("Pending")
+    SENT = "sent", _("Sent")
+    DEAD = "dead", _("Dead")
+
+
 UKRAINIAN_MONTHS = {
     1: "Січень",
     2: "Лютий",
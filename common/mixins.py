@@ -0,0 +1,132 @@
+import hashlib
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db.models import Count, Max
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class ConditionalListMixin:
+    """
+    List mixin answering conditional GET requests.
+    The ETag and Last-Modified validators come from one aggregate query
+    returning the latest modification time and the number of rows of the
+    filtered queryset. An unchanged list is answered with 304 before any
+    row is fetched or serialized.
+    A deleted row does not move the modification time, so every
+    Last-Modified sent is remembered in the cache with its ETag, and
+    If-Modified-Since only matches while the ETag (which has the number of
+    rows) is the same.
+    """
+
+    # Fields whose latest value is the modification time of the list
+    last_modified_fields = ("updated_at",)
+    # How long a Last-Modified is remembered, later it is always modified
+    last_modified_timeout = 60 * 60 * 24
+
+    def get_list_scope(self, queryset) -> str:
+        """Return the digest of the query and the parameters of the list."""
+        # The query and the parameters shaping the response make lists of
+        # other users or other pages get their own validators
+        try:
+            query = str(queryset.query)
+        except EmptyResultSet:
+            query = ""
+        fields = self.request.query_params.get("fields")
+        if fields is None and hasattr(self.request.data, "get"):
+            fields = self.request.data.get("fields")
+        return hashlib.md5(
+            "|".join(
+                (query, self.request.get_full_path(), str(fields))
+            ).encode()
+        ).hexdigest()
+
+    def get_list_validators(
+        self, queryset, scope: str
+    ) -> tuple[str, int | None]:
+        """Return the ETag and the Last-Modified timestamp of the list."""
+        aggregates = queryset.order_by().aggregate(
+            rows=Count("pk"),
+            **{
+                f"last_{index}": Max(field)
+                for index, field in enumerate(self.last_modified_fields)
+            },
+        )
+        last_modified = max(
+            (
+                value
+                for name, value in aggregates.items()
+                if name != "rows" and value is not None
+            ),
+            default=None,
+        )
+
+        digest = hashlib.md5(
+            "|".join(
+                (
+                    scope,
+                    str(aggregates["rows"]),
+                    last_modified.isoformat() if last_modified else "",
+                )
+            ).encode()
+        ).hexdigest()
+        return (
+            f'"{digest}"',
+            int(last_modified.timestamp()) if last_modified else None,
+        )
+
+    @staticmethod
+    def _last_modified_key(scope: str, last_modified: int) -> str:
+        return f"list-last-modified:{scope}:{last_modified}"
+
+    def is_not_modified(
+        self, request, scope: str, etag: str, last_modified: int | None
+    ) -> bool:
+        """Check the validators sent by the client."""
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match is not None:
+            tags = {tag.strip() for tag in if_none_match.split(",")}
+            return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+        if_modified_since = parse_http_date_safe(
+            request.headers.get("If-Modified-Since")
+        )
+        if (
+            if_modified_since is None
+            or last_modified is None
+            or last_modified > if_modified_since
+        ):
+            return False
+        # Rows may have been deleted since, the ETag counts them
+        sent_etag = cache.get(
+            self._last_modified_key(scope, if_modified_since)
+        )
+        return sent_etag == etag
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        scope = self.get_list_scope(queryset)
+        etag, last_modified = self.get_list_validators(queryset, scope)
+
+        if self.is_not_modified(request, scope, etag, last_modified):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            page = self.paginate_queryset(queryset)
+            if page is not None:
+                serializer = self.get_serializer(page, many=True)
+                response = self.get_paginated_response(serializer.data)
+            else:
+                serializer = self.get_serializer(queryset, many=True)
+                response = Response(serializer.data)
+
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
+            cache.set(
+                self._last_modified_key(scope, last_modified),
+                etag,
+                self.last_modified_timeout,
+            )
+        return response
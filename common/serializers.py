@@ -0,0 +1,32 @@
+class SparseFieldsetsMixin:
+    """
+    Serializer mixin that keeps only the fields listed in the `fields`
+    request parameter, e.g. ?fields=id,start_date. The parameter is read
+    from the query string or, for clients sending it in the body, from the
+    request data. Unknown names are ignored. Only read requests are
+    affected, so writes still validate every field. Without a request the
+    `fields` serializer context entry is used.
+    """
+
+    fields_param = "fields"
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get("request")
+        if request is None:
+            requested = self.context.get(self.fields_param)
+        elif request.method not in ("GET", "HEAD"):
+            return fields
+        else:
+            requested = request.query_params.get(self.fields_param)
+            if requested is None and hasattr(request.data, "get"):
+                requested = request.data.get(self.fields_param)
+        if not requested:
+            return fields
+
+        if isinstance(requested, str):
+            requested = requested.split(",")
+        requested = {name.strip() for name in requested}
+        return {
+            name: field for name, field in fields.items() if name in requested
+        }
@@ -0,0 +1,62 @@
+from django.utils.functional import SimpleLazyObject
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import (
+    BaseAuthentication,
+    get_authorization_header,
+)
+
+from staff.services import read_api_token
+
+
+class LazyEmployee(SimpleLazyObject):
+    """
+    Employee authenticated by an API token.
+    The id and the authentication flags are known from the token, the
+    employee is loaded from the database only when anything else is used.
+    """
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, employee_id: int):
+        from staff.models import Employee
+
+        super().__init__(lambda: Employee.objects.get(pk=employee_id))
+        self.__dict__["_employee_id"] = employee_id
+
+    @property
+    def pk(self) -> int:
+        return self.__dict__["_employee_id"]
+
+    id = pk
+
+    def __bool__(self):
+        return True
+
+
+class TelegramTokenAuthentication(BaseAuthentication):
+    """
+    Authenticates the requests carrying a token issued by the token
+    exchange endpoint: "Authorization: Bearer <token>".
+    The token is verified by its signature, without a database query.
+    """
+
+    keyword = "Bearer"
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed(_("Invalid token header."))
+
+        employee_id = read_api_token(auth[1].decode(errors="replace"))
+        if employee_id is None:
+            raise exceptions.AuthenticationFailed(
+                _("Invalid or expired token.")
+            )
+        return LazyEmployee(employee_id), auth[1]
+
+    def authenticate_header(self, request):
+        return self.keyword
@@ -100,3 +100,9 @@ class DutyRoster(BaseModel):
         verbose_name = _("Duty Roster")
         verbose_name_plural = _("Duty Rosters")
         ordering = ("-start_date",)
+        constraints = [
+            models.UniqueConstraint(
+                fields=["start_date"],
+                name="duty_roster_unique_start_date",
+            ),
+        ]
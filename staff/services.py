@@ -1,14 +1,20 @@
 import hashlib
+import heapq
 import hmac
 import time
 import uuid
+from bisect import bisect_right
+from datetime import date, timedelta
 from pathlib import Path
 from typing import Any
 
 from django.conf import settings
+from django.core import signing
 
 from common.logger import logger
 
+API_TOKEN_SALT = "staff.api-token"
+
 
 def generate_path(instance, filename: str) -> str:
     """Generate a path for photo upload."""
@@ -41,13 +47,15 @@ def check_telegram_auth(data: dict[str, Any], bot_token: str) -> bool:
     if current_time - int(auth_date) > 86400:
         return False
 
-    # Get the hash for verification
-    check_hash = data.pop("hash", None)
+    # Get the hash for verification, the data itself is left untouched
+    check_hash = data.get("hash")
     if not check_hash:
         return False
 
     # Create the data check string from sorted keys and values
-    data_check_string = "\n".join(f"{k}={v}" for k, v in sorted(data.items()))
+    data_check_string = "\n".join(
+        f"{k}={v}" for k, v in sorted(data.items()) if k != "hash"
+    )
 
     # Compute the secret key using the bot token
     secret_key = hashlib.sha256(bot_token.encode()).digest()
@@ -58,4 +66,131 @@ def check_telegram_auth(data: dict[str, Any], bot_token: str) -> bool:
     ).hexdigest()
 
     # Return the result of comparing the calculated hash with the provided hash
-    return calculated_hash == check_hash
+    return hmac.compare_digest(calculated_hash, str(check_hash))
+
+
+def make_api_token(employee_id: int) -> str:
+    """Return a signed token authenticating the employee in the API."""
+    return signing.dumps({"employee_id": employee_id}, salt=API_TOKEN_SALT)
+
+
+def read_api_token(token: str) -> int | None:
+    """
+    Return the id of the employee the token was issued to, or None if the
+    token is forged or older than TELEGRAM_API_TOKEN_MAX_AGE.
+    """
+    try:
+        payload = signing.loads(
+            token,
+            salt=API_TOKEN_SALT,
+            max_age=settings.TELEGRAM_API_TOKEN_MAX_AGE,
+        )
+    except signing.BadSignature:
+        return None
+    return payload.get("employee_id")
+
+
+def plan_duty_roster(first_saturday: date, weeks: int) -> list:
+    """
+    Plan the weekend duties of the given number of weeks in one insert.
+    Weekends that already have a duty are kept as they are, so planning the
+    same weeks again creates nothing. Every weekend goes to the eligible
+    employee with the fewest duties so far, ties are broken by the rotation
+    order that continues after the employee of the last duty. Employees with
+    an approved leave overlapping the weekend are skipped.
+    Returns the created duties.
+    """
+    from django.db.models import Count, Q
+
+    from common.enums import StatusRequestChoices
+    from staff.models import DutyRoster, Employee
+    from vacation.models import LeaveRequest
+
+    weekends = [
+        (saturday, saturday + timedelta(days=1))
+        for saturday in (
+            first_saturday + timedelta(weeks=week) for week in range(weeks)
+        )
+    ]
+    planned = set(
+        DutyRoster.objects.filter(
+            start_date__range=(weekends[0][0], weekends[-1][0])
+        ).values_list("start_date", flat=True)
+    )
+    weekends = [weekend for weekend in weekends if weekend[0] not in planned]
+    if not weekends:
+        return []
+
+    # Historical number of duties of every eligible employee, by id
+    duty_counts = dict(
+        Employee.objects.filter(can_duty=True)
+        .annotate(
+            duties=Count(
+                "duty_rosters",
+                filter=Q(duty_rosters__start_date__lt=weekends[0][0]),
+            )
+        )
+        .order_by("pk")
+        .values_list("pk", "duties")
+    )
+    if not duty_counts:
+        return []
+    employee_ids = list(duty_counts)
+
+    # The rotation continues after the employee of the last duty, even if
+    # that employee can no longer be on duty
+    last_duty = (
+        DutyRoster.objects.filter(start_date__lt=weekends[0][0])
+        .order_by("-start_date", "-pk")
+        .values_list("employee_id", flat=True)
+        .first()
+    )
+    pointer = bisect_right(employee_ids, last_duty) if last_duty else 0
+
+    # Approved leaves overlapping the planned period, by employee
+    leaves = {}
+    for employee_id, start_date, end_date in LeaveRequest.objects.filter(
+        employee_id__in=employee_ids,
+        status=StatusRequestChoices.APPROVED,
+        start_date__lte=weekends[-1][1],
+        end_date__gte=weekends[0][0],
+    ).values_list("employee_id", "start_date", "end_date"):
+        leaves.setdefault(employee_id, []).append((start_date, end_date))
+
+    # (duties, rotation rank, employee_id), an assigned employee gets the
+    # next free rank and moves behind everybody else
+    size = len(employee_ids)
+    heap = [
+        (duty_counts[employee_id], (index - pointer) % size, employee_id)
+        for index, employee_id in enumerate(employee_ids)
+    ]
+    next_rank = size
+    heapq.heapify(heap)
+
+    duties = []
+    for saturday, sunday in weekends:
+        skipped = []
+        while heap:
+            duties_count, rank, employee_id = heapq.heappop(heap)
+            if any(
+                start <= sunday and end >= saturday
+                for start, end in leaves.get(employee_id, ())
+            ):
+                skipped.append((duties_count, rank, employee_id))
+                continue
+            duties.append(
+                DutyRoster(
+                    employee_id=employee_id,
+                    start_date=saturday,
+                    end_date=sunday,
+                )
+            )
+            heapq.heappush(heap, (duties_count + 1, next_rank, employee_id))
+            next_rank += 1
+            break
+        else:
+            logger.warning("Nobody is available for duty on %s", saturday)
+        for item in skipped:
+            heapq.heappush(heap, item)
+
+    return DutyRoster.objects.bulk_create(duties, ignore_conflicts=True)
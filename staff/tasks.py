@@ -1,50 +1,33 @@
 import logging
 
 from celery import shared_task
+from django.conf import settings
 from django.utils import timezone
-from .models import Employee, DutyRoster
 
+from staff.services import plan_duty_roster
 
 logger = logging.getLogger(__name__)
 
 
 @shared_task
-def update_duty_roster():
-    """Task to update the duty roster."""
+def update_duty_roster(weeks: int | None = None):
+    """
+    Task to update the duty roster.
+    Plans the weekends of the next weeks, the ones already planned are kept.
+    """
 
-    today = timezone.now().date()
-    next_saturday = today + timezone.timedelta(days=(5 - today.weekday()) % 7)
-    next_sunday = next_saturday + timezone.timedelta(days=1)
-
-    logger.info(
-        f"Next Saturday: %s, Next Sunday: %s", next_saturday, next_sunday
-    )
-
-    # We receive all employees who can be on duty
-    employees = Employee.objects.filter(can_duty=True).order_by("id")
-
-    # We check whether there are employees on duty
-    if not employees:
-        logger.warning("No employees available for duty.")
-        return
+    from vacation.services import invalidate_org_dashboard
 
-    # We get the last duty
-    last_duty = DutyRoster.objects.order_by("id").last()
+    weeks = weeks or settings.DUTY_ROSTER_WEEKS_AHEAD
+    today = timezone.localdate()
+    next_saturday = today + timezone.timedelta(days=(5 - today.weekday()) % 7)
 
-    if last_duty:
-        # We find the index of the last employee
-        last_employee_index = list(employees).index(last_duty.employee)
-        next_employee = employees[(last_employee_index + 1) % len(employees)]
+    duties = plan_duty_roster(next_saturday, weeks)
+    for duty in duties:
+        logger.info("New duty created: %s", duty)
 
+    if duties:
+        # bulk_create does not send the signals that refresh the dashboard
+        invalidate_org_dashboard()
     else:
-        # If this is the first duty
-        next_employee = employees.first()
-
-    logger.info(f"Next employee for duty: %s", next_employee)
-
-    # We create a new record about duty
-    new_duty = DutyRoster.objects.create(
-        employee=next_employee, start_date=next_saturday, end_date=next_sunday
-    )
-
-    logger.info("New duty created: %s", new_duty)
+        logger.info("The next %s weekends are already planned.", weeks)
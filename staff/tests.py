@@ -1,3 +1,80 @@
+from datetime import date, timedelta
+
 from django.test import TestCase
 
-# Create your tests here.
+from common.enums import StatusRequestChoices
+from staff.models import DutyRoster, Employee
+from staff.services import plan_duty_roster
+from vacation.models import LeaveRequest, LeaveType
+
+FIRST_SATURDAY = date(2031, 3, 1)
+
+
+class PlanDutyRosterTests(TestCase):
+    def setUp(self):
+        self.employees = [
+            Employee.objects.create(username=username, can_duty=True)
+            for username in ("first", "second", "third")
+        ]
+        Employee.objects.create(username="never", can_duty=False)
+
+    def planned_usernames(self) -> list[str]:
+        return list(
+            DutyRoster.objects.order_by("start_date").values_list(
+                "employee__username", flat=True
+            )
+        )
+
+    def test_duties_rotate_fairly(self):
+        plan_duty_roster(FIRST_SATURDAY, 6)
+
+        self.assertEqual(
+            self.planned_usernames(),
+            ["first", "second", "third", "first", "second", "third"],
+        )
+
+    def test_rotation_continues_after_the_last_duty(self):
+        DutyRoster.objects.create(
+            employee=self.employees[1],
+            start_date=FIRST_SATURDAY - timedelta(weeks=1),
+            end_date=FIRST_SATURDAY - timedelta(days=6),
+        )
+        DutyRoster.objects.create(
+            employee=self.employees[0],
+            start_date=FIRST_SATURDAY - timedelta(weeks=2),
+            end_date=FIRST_SATURDAY - timedelta(days=13),
+        )
+
+        plan_duty_roster(FIRST_SATURDAY, 3)
+
+        # "third" had no duty yet, then the rotation goes on after "second"
+        self.assertEqual(
+            self.planned_usernames()[2:],
+            ["third", "first", "second"],
+        )
+
+    def test_planning_the_same_weeks_again_creates_nothing(self):
+        self.assertEqual(len(plan_duty_roster(FIRST_SATURDAY, 4)), 4)
+        planned = self.planned_usernames()
+
+        self.assertEqual(plan_duty_roster(FIRST_SATURDAY, 4), [])
+        self.assertEqual(self.planned_usernames(), planned)
+
+        # Only the weeks not planned yet are added
+        self.assertEqual(len(plan_duty_roster(FIRST_SATURDAY, 5)), 1)
+
+    def test_employees_on_leave_are_skipped(self):
+        LeaveRequest.objects.create(
+            employee=self.employees[0],
+            leave_type=LeaveType.objects.create(title="Duty leave"),
+            start_date=FIRST_SATURDAY - timedelta(days=1),
+            end_date=FIRST_SATURDAY + timedelta(days=3),
+            status=StatusRequestChoices.APPROVED,
+        )
+
+        plan_duty_roster(FIRST_SATURDAY, 3)
+
+        # "first" keeps the front of the rotation for the next weekend
+        self.assertEqual(
+            self.planned_usernames(), ["second", "first", "third"]
+        )
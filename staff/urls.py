@@ -12,6 +12,12 @@ urlpatterns = [
         views.ProfileUpdateView.as_view(),
         name="account_profile_update",
     ),
+    # API
+    path(
+        "api/auth/telegram-token/",
+        views.TelegramTokenView.as_view(),
+        name="telegram_token",
+    ),
 ]
 
 app_name = "staff"
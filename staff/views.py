@@ -1,11 +1,19 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
 from django.urls import reverse_lazy
 from django.views.generic import DetailView, UpdateView
 from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from common.env import env
 from staff.forms import EmployeeForm
+from staff.models import Employee
+from staff.services import check_telegram_auth, make_api_token
 
 
 class ProfileView(DetailView):
@@ -27,3 +35,40 @@ class ProfileUpdateView(LoginRequiredMixin, SuccessMessageMixin, UpdateView):
 
     def get_object(self):
         return self.request.user
+
+
+class TelegramTokenView(APIView):
+    """
+    Exchange the signed Telegram payload (telegram_id, auth_date, hash) for
+    a short-lived API token to send as "Authorization: Bearer <token>".
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        if not check_telegram_auth(request.data, env.str("BOT_TOKEN")):
+            return Response(
+                {"detail": _("Invalid Telegram authentication data.")},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+
+        employee_id = (
+            Employee.objects.filter(
+                telegram_id=request.data.get("telegram_id"), is_active=True
+            )
+            .values_list("pk", flat=True)
+            .first()
+        )
+        if employee_id is None:
+            return Response(
+                {"detail": _("Employee not found.")},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        return Response(
+            {
+                "token": make_api_token(employee_id),
+                "expires_in": settings.TELEGRAM_API_TOKEN_MAX_AGE,
+            }
+        )
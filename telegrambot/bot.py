@@ -1,5 +1,4 @@
-import hashlib
-import hmac
+import asyncio
 import json
 import logging
 import time
@@ -12,10 +11,15 @@ from aiogram.enums import ParseMode
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message
-import aiohttp
 from environs import Env
 
+from telegrambot.cache import ApiResponseCache, CachePolicy
+from telegrambot.client import ApiClient, CircuitBreaker
+from telegrambot.middlewares import ThrottlingMiddleware
 from telegrambot.state import VacationForm
+from telegrambot.storage import create_storage
+from telegrambot.transport import HttpTransport, OrmTransport
+from telegrambot.webhook import run_webhook
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -30,20 +34,69 @@ bot = Bot(
     token=env.str("BOT_TOKEN"),
     default=DefaultBotProperties(parse_mode=ParseMode.HTML),
 )
-dp = Dispatcher()
-
+storage, events_isolation = create_storage()
+dp = Dispatcher(storage=storage, events_isolation=events_isolation)
+
+# Per-user rate limit and cap of the messages handled at once
+throttling = ThrottlingMiddleware(
+    rate=env.float("THROTTLE_RATE", 1),
+    burst=env.float("THROTTLE_BURST", 5),
+    max_in_flight=env.int("MAX_IN_FLIGHT_UPDATES", 100),
+)
+dp.message.outer_middleware(throttling)
+
+# Shared client for the staff API, its session lives as long as the dispatcher
+api_client = ApiClient(
+    base_url=env.str("STAFF_API_URL"),
+    pool_size=env.int("API_POOL_SIZE", 20),
+    timeout=env.float("API_TIMEOUT", 10),
+    retries=env.int("API_RETRIES", 2),
+    breaker=CircuitBreaker(
+        failure_threshold=env.int("API_CIRCUIT_FAILURES", 5),
+        reset_timeout=env.float("API_CIRCUIT_RESET", 30),
+    ),
+)
 
-def compute_hmac_hash(params: dict[str, Any], secret: str) -> str:
-    """Compute the HMAC hash for the given params."""
+# Cache of read-mostly API responses
+response_cache = ApiResponseCache(
+    {
+        "leave-type": CachePolicy(ttl=env.float("LEAVE_TYPE_CACHE_TTL", 300)),
+        "leave-requests/telegram_is_employee": CachePolicy(
+            ttl=env.float("EMPLOYEE_CACHE_TTL", 600),
+            maxsize=10_000,
+            key_params=("telegram_id",),
+            # A user just added as an employee is let in at once
+            cacheable=lambda response: response.get("status") is True,
+        ),
+    }
+)
 
-    data_check_string = "\n".join(
-        f"{k}={v}" for k, v in sorted(params.items())
+# How the API is reached: "http", or "orm" in process next to Django
+transport = (
+    OrmTransport()
+    if env.str("API_TRANSPORT", "http") == "orm"
+    else HttpTransport(
+        api_client,
+        env.str("BOT_TOKEN"),
+        token_ttl=env.float("API_TOKEN_TTL", 3000),
     )
-    secret_key = hashlib.sha256(secret.encode()).digest()
-    computed_hash = hmac.new(
-        secret_key, data_check_string.encode(), hashlib.sha256
-    ).hexdigest()
-    return computed_hash
+)
+
+
+@dp.startup()
+async def on_startup():
+    """Open the API transport."""
+    await transport.start()
+
+
+@dp.shutdown()
+async def on_shutdown():
+    """Close the API transport and the FSM storage."""
+    logger.info("Throttling: %s", throttling.stats())
+    logger.info("API response cache: %s", response_cache.stats())
+    await transport.close()
+    await storage.close()
+    await events_isolation.close()
 
 
 async def check_date_overlap(
@@ -64,25 +117,13 @@ async def check_date_overlap(
 async def make_api_request(
     method: str, endpoint: str, **params: Any
 ) -> Optional[dict]:
-    """Make API requests."""
-
-    url = f"{env.str('STAFF_API_URL')}/{endpoint}/"
-    headers = {"Content-Type": "application/json"}
-    params["hash"] = compute_hmac_hash(params, env.str("BOT_TOKEN"))
-
-    # Fetch JSON data
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.request(
-                method, url, json=params, headers=headers
-            ) as response:
-                response.raise_for_status()
-                return await response.json()
-        except aiohttp.ClientError as client_error:
-            logger.error("Error fetching data: %s", client_error)
-        except Exception as general_error:
-            logger.error("An error occurred: %s", general_error)
-        return None
+    """Make API requests, serving read-mostly endpoints from the cache."""
+    return await response_cache.fetch(
+        method,
+        endpoint,
+        params,
+        lambda: transport.request(method, endpoint, params),
+    )
 
 
 @dp.message(Command(commands=["start"]))
@@ -98,9 +139,12 @@ async def my_leaves(message: Message):
     params = {
         "telegram_id": message.from_user.id,
         "auth_date": int(time.time()),
+        # Only the fields printed below
+        "fields": "start_date,end_date,status",
     }
 
-    leave_requests = await make_api_request("GET", "leave-requests", **params)
+    page = await make_api_request("GET", "leave-requests", **params)
+    leave_requests = page["results"] if page else None
     response = (
         "No leave requests found."
         if not leave_requests
@@ -110,6 +154,8 @@ async def my_leaves(message: Message):
             for leave in leave_requests
         )
     )
+    if page and page["next"]:
+        response += "\n..."
 
     await message.answer(response)
 
@@ -238,18 +284,20 @@ async def process_leave_type(message: Message, state: FSMContext):
         "end_date": data["end_date"].strftime("%Y-%m-%d"),
         "comment": data["comment"],
         "leave_type": data["leave_type"],
+        # The same message gives the same key, so a retried or redelivered
+        # submission does not create a second request
+        "idempotency_key": f"{message.chat.id}:{message.message_id}",
     }
 
-    # Create vacation form and save
+    # Create the vacation request already sent for approval
     new_vacation_request = await make_api_request(
-        "POST", "leave-requests", **params
-    )
-    # Send for approval
-    await make_api_request(
-        "POST",
-        f"leave-requests/{new_vacation_request['id']}/save_and_submit",
-        **params,
+        "POST", "leave-requests/submit", **params
     )
+    if not new_vacation_request:
+        await message.answer(
+            "The leave request could not be created, please try again."
+        )
+        return
     response = json.dumps(new_vacation_request, indent=4, ensure_ascii=False)
 
     await message.answer(
@@ -258,12 +306,17 @@ async def process_leave_type(message: Message, state: FSMContext):
     await state.clear()
 
 
-async def main():
-    """Start the bot."""
-    await dp.start_polling(bot)
+def main():
+    """
+    Start the bot.
+    With WEBHOOK_URL set the updates are received by the webhook server,
+    otherwise by long polling (for development).
+    """
+    if env.str("WEBHOOK_URL", ""):
+        run_webhook(dp, bot)
+    else:
+        asyncio.run(dp.start_polling(bot))
 
 
 if __name__ == "__main__":
-    import asyncio
-
-    asyncio.run(main())
+    main()
@@ -0,0 +1,130 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+
+class TTLCache:
+    """LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable) -> tuple[bool, Any]:
+        """Return a (found, value) pair for the key."""
+        entry = self._data.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return False, None
+        self._data.move_to_end(key)
+        return True, value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class CachePolicy:
+    """How the responses of one endpoint are cached."""
+
+    def __init__(
+        self,
+        ttl: float,
+        maxsize: int = 1,
+        key_params: tuple[str, ...] = (),
+        cacheable: Optional[Callable[[Any], bool]] = None,
+    ):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        # Request params the response depends on
+        self.key_params = key_params
+        # Which responses are kept, every one by default
+        self.cacheable = cacheable
+
+
+class ApiResponseCache:
+    """
+    Cache of the GET responses of the staff API with a policy per endpoint.
+    Endpoints without a policy are never cached.
+    """
+
+    def __init__(self, policies: dict[str, CachePolicy]):
+        self.policies = policies
+        self._caches = {
+            endpoint: TTLCache(policy.maxsize, policy.ttl)
+            for endpoint, policy in policies.items()
+        }
+        self.hits = {endpoint: 0 for endpoint in policies}
+        self.misses = {endpoint: 0 for endpoint in policies}
+
+    def _key(self, endpoint: str, params: dict[str, Any]) -> tuple:
+        return tuple(
+            params.get(name) for name in self.policies[endpoint].key_params
+        )
+
+    async def fetch(
+        self,
+        method: str,
+        endpoint: str,
+        params: dict[str, Any],
+        loader: Callable[[], Awaitable[Optional[Any]]],
+    ) -> Optional[Any]:
+        """Return the cached response or load it and cache the result."""
+        if method != "GET" or endpoint not in self.policies:
+            return await loader()
+
+        cache = self._caches[endpoint]
+        key = self._key(endpoint, params)
+        found, value = cache.get(key)
+        if found:
+            self.hits[endpoint] += 1
+            return value
+
+        self.misses[endpoint] += 1
+        value = await loader()
+        # Failed requests are not cached so that they are retried next time
+        cacheable = self.policies[endpoint].cacheable
+        if value is not None and (cacheable is None or cacheable(value)):
+            cache.set(key, value)
+        return value
+
+    def invalidate(self, endpoint: Optional[str] = None, **params: Any):
+        """
+        Drop cached responses.
+        Without an endpoint everything is dropped, without params every
+        response of the endpoint is dropped.
+        """
+        if endpoint is None:
+            for cache in self._caches.values():
+                cache.clear()
+        elif endpoint in self._caches:
+            if params:
+                self._caches[endpoint].delete(self._key(endpoint, params))
+            else:
+                self._caches[endpoint].clear()
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Return the hit/miss counters and the size of every endpoint."""
+        return {
+            endpoint: {
+                "hits": self.hits[endpoint],
+                "misses": self.misses[endpoint],
+                "size": len(self._caches[endpoint]),
+            }
+            for endpoint in self.policies
+        }
@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Optional
+
+import aiohttp
+
+from telegrambot.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class ApiAuthenticationError(Exception):
+    """The API rejected the credentials of the request (401 or 403)."""
+
+    def __init__(self, status: int):
+        super().__init__(f"API rejected the credentials: {status}")
+        self.status = status
+
+
+class CircuitBreaker:
+    """
+    Simple circuit breaker.
+    After `failure_threshold` consecutive failures the circuit opens and calls
+    fail fast for `reset_timeout` seconds. Then a single trial call is let
+    through: its success closes the circuit, its failure opens it again,
+    and a trial ending without either (cancelled) frees the slot.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow_request(self) -> bool:
+        """Return True if a call may be made now."""
+        if self.opened_at is None:
+            return True
+        if self._trial_running:
+            return False
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._trial_running = True
+            return True
+        return False
+
+    def release_trial(self) -> None:
+        """Let another trial call through, the circuit stays as it is."""
+        self._trial_running = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_running = False
+        if self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning(
+                    "API circuit opened after %s failures", self.failures
+                )
+            self.opened_at = time.monotonic()
+
+
+class ApiClient:
+    """
+    Client for the staff API sharing one aiohttp session.
+    The session keeps a bounded pool of keep-alive connections. Idempotent
+    requests, and the ones carrying an idempotency key, are retried with
+    exponential backoff and full jitter on network errors, timeouts and 5xx
+    responses. A circuit breaker makes calls fail fast while the backend
+    keeps failing. GET responses carrying an ETag are kept and revalidated
+    with If-None-Match, a 304 reuses the kept body.
+    """
+
+    IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+    # Payload key making any request safe to retry
+    IDEMPOTENCY_KEY_PARAM = "idempotency_key"
+    # Payload keys that change on every call without changing the response
+    VOLATILE_PARAMS = frozenset(("auth_date", "hash"))
+
+    def __init__(
+        self,
+        base_url: str,
+        pool_size: int = 20,
+        timeout: float = 10,
+        retries: int = 2,
+        backoff: float = 0.3,
+        breaker: Optional[CircuitBreaker] = None,
+        validators_size: int = 10_000,
+        validators_ttl: float = 3600,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self._session: Optional[aiohttp.ClientSession] = None
+        # (endpoint, params) -> (etag, body) of the last GET responses
+        self._validators = TTLCache(validators_size, validators_ttl)
+
+    async def start(self) -> None:
+        """Open the shared session."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size,
+                keepalive_timeout=30,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers={"Content-Type": "application/json"},
+            )
+
+    async def close(self) -> None:
+        """Close the shared session and its connections."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def request(
+        self,
+        method: str,
+        endpoint: str,
+        payload: dict[str, Any],
+        headers: Optional[dict[str, str]] = None,
+        raise_auth_errors: bool = False,
+    ) -> Optional[Any]:
+        """
+        Send the request and return the decoded JSON body.
+        Returns None if the request failed or the circuit is open. With
+        `raise_auth_errors` a 401 or 403 raises ApiAuthenticationError, so
+        that the caller can renew its credentials.
+        """
+        if not self.breaker.allow_request():
+            logger.warning(
+                "API circuit is open, skipping %s %s", method, endpoint
+            )
+            return None
+
+        # Allowed while open, this call is the trial of the circuit
+        trial = self.breaker.is_open
+        try:
+            return await self._send(
+                method, endpoint, payload, headers, raise_auth_errors
+            )
+        finally:
+            # A cancelled trial records nothing, it must not hold the slot
+            if trial:
+                self.breaker.release_trial()
+
+    async def _send(
+        self,
+        method: str,
+        endpoint: str,
+        payload: dict[str, Any],
+        headers: Optional[dict[str, str]],
+        raise_auth_errors: bool,
+    ) -> Optional[Any]:
+        # The session is normally opened by the dispatcher startup hook
+        await self.start()
+
+        url = f"{self.base_url}/{endpoint}/"
+        attempts = 1 + (
+            self.retries
+            if method in self.IDEMPOTENT_METHODS
+            or self.IDEMPOTENCY_KEY_PARAM in payload
+            else 0
+        )
+
+        headers = dict(headers or {})
+        validator_key = None
+        found = False
+        if method == "GET":
+            validator_key = (
+                endpoint,
+                tuple(
+                    sorted(
+                        (key, str(value))
+                        for key, value in payload.items()
+                        if key not in self.VOLATILE_PARAMS
+                    )
+                ),
+            )
+            found, validator = self._validators.get(validator_key)
+            if found:
+                headers["If-None-Match"] = validator[0]
+
+        for attempt in range(attempts):
+            try:
+                async with self._session.request(
+                    method, url, json=payload, headers=headers
+                ) as response:
+                    if response.status < 500:
+                        # The backend answered, a 4xx is not its failure
+                        self.breaker.record_success()
+                    if response.status == 304 and found:
+                        return validator[1]
+                    response.raise_for_status()
+                    body = await response.json()
+                    etag = response.headers.get("ETag")
+                    if validator_key is not None and etag:
+                        self._validators.set(validator_key, (etag, body))
+                    return body
+            except aiohttp.ClientResponseError as response_error:
+                if raise_auth_errors and response_error.status in (401, 403):
+                    raise ApiAuthenticationError(response_error.status)
+                if response_error.status < 500:
+                    logger.error("Error fetching data: %s", response_error)
+                    return None
+                error = response_error
+            except (aiohttp.ClientError, asyncio.TimeoutError) as client_error:
+                error = client_error
+            except Exception as general_error:
+                logger.error("An error occurred: %s", general_error)
+                return None
+
+            self.breaker.record_failure()
+            if attempt + 1 == attempts or not self.breaker.allow_request():
+                logger.error("Error fetching data: %r", error)
+                return None
+
+            delay = random.uniform(0, self.backoff * 2**attempt)
+            logger.info(
+                "Retrying %s %s in %.2fs (%r)", method, endpoint, delay, error
+            )
+            await asyncio.sleep(delay)
+        return None
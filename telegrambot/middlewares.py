@@ -0,0 +1,95 @@
+import logging
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import Message
+
+from telegrambot.cache import TTLCache
+from telegrambot.notifier import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Outer message middleware shedding load before the handlers call the API.
+    Every user has a token bucket of `rate` messages per second with bursts
+    of `burst` messages, and at most `max_in_flight` messages are handled at
+    once by the process. Since a handler makes its API calls one after
+    another, this also bounds the API calls in flight. A message over either
+    limit is not handled: the user gets a short busy reply instead, once
+    until they may send again, and the throttled or dropped counter grows.
+    """
+
+    def __init__(
+        self,
+        rate: float = 1,
+        burst: float = 5,
+        max_in_flight: int = 100,
+        busy_text: str = "Too many requests, please try again in a moment.",
+        maxsize: int = 10_000,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.busy_text = busy_text
+        # An evicted bucket would have been full again by then
+        self._buckets = TTLCache(maxsize, ttl=burst / rate)
+        self._warned = TTLCache(maxsize, ttl=1 / rate)
+        self.in_flight = 0
+        self.handled = 0
+        self.throttled = 0
+        self.dropped = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is not None and not self._take_token(user.id):
+            self.throttled += 1
+            await self._reply_busy(event, user.id)
+            return None
+
+        if self.in_flight >= self.max_in_flight:
+            self.dropped += 1
+            await self._reply_busy(event, user.id if user else None)
+            return None
+
+        self.in_flight += 1
+        self.handled += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.in_flight -= 1
+
+    def _take_token(self, user_id: int) -> bool:
+        found, bucket = self._buckets.get(user_id)
+        if not found:
+            bucket = TokenBucket(self.rate, capacity=self.burst)
+        # Set again to keep the bucket while the user is active
+        self._buckets.set(user_id, bucket)
+        return bucket.try_acquire()
+
+    async def _reply_busy(self, event: Message, user_id: int | None) -> None:
+        if user_id is not None:
+            found, _ = self._warned.get(user_id)
+            if found:
+                return
+            self._warned.set(user_id, True)
+        try:
+            await event.answer(self.busy_text)
+        except TelegramAPIError as e:
+            logger.warning("Could not send the busy reply: %s", e)
+
+    def stats(self) -> dict[str, int]:
+        """Return the counters of the handled, throttled and dropped messages."""
+        return {
+            "in_flight": self.in_flight,
+            "handled": self.handled,
+            "throttled": self.throttled,
+            "dropped": self.dropped,
+        }
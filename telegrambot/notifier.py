@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Iterable, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from environs import Env
+
+logger = logging.getLogger(__name__)
+
+env = Env()
+env.read_env()
+
+
+class TokenBucket:
+    """Token bucket allowing `rate` acquisitions per second on average."""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available, without waiting."""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self) -> None:
+        """Wait until a token is available and take it."""
+        async with self._lock:
+            while not self.try_acquire():
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class NotificationSender:
+    """
+    Sends the same message to many Telegram chats from synchronous code.
+    One event loop is kept per process so that the bot session (bound to
+    the loop) is reused between calls. Sending respects a global and a
+    per-chat rate limit, waits on RetryAfter and retries network and server
+    errors with backoff.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = 25,
+        per_chat_rate: float = 1,
+        max_attempts: int = 3,
+        backoff: float = 1,
+    ):
+        self.bot = bot
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.per_chat_rate = per_chat_rate
+        self._loop = asyncio.new_event_loop()
+        self._global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self._chat_buckets: dict[int, TokenBucket] = {}
+
+    def send_many(self, chat_ids: Iterable[int], text: str) -> list[dict]:
+        """
+        Send the text to every distinct chat and return one delivery result
+        per chat: {"chat_id", "delivered", "attempts", "error"}.
+        """
+        return self._loop.run_until_complete(
+            self._send_many(list(dict.fromkeys(chat_ids)), text)
+        )
+
+    def close(self) -> None:
+        """Close the bot session and the event loop."""
+        if not self._loop.is_closed():
+            self._loop.run_until_complete(self.bot.session.close())
+            self._loop.close()
+
+    async def _send_many(self, chat_ids: list[int], text: str) -> list[dict]:
+        return list(
+            await asyncio.gather(
+                *(self._send_one(chat_id, text) for chat_id in chat_ids)
+            )
+        )
+
+    async def _send_one(self, chat_id: int, text: str) -> dict:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(
+                self.per_chat_rate
+            )
+
+        error: Optional[str] = None
+        for attempt in range(1, self.max_attempts + 1):
+            await bucket.acquire()
+            await self._global_bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id, text)
+                return {
+                    "chat_id": chat_id,
+                    "delivered": True,
+                    "attempts": attempt,
+                    "error": None,
+                }
+            except TelegramRetryAfter as e:
+                error = str(e)
+                await asyncio.sleep(e.retry_after)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                error = str(e)
+                await asyncio.sleep(
+                    random.uniform(0, self.backoff * 2 ** (attempt - 1))
+                )
+            except TelegramAPIError as e:
+                # Blocked bot, unknown chat, etc. Retrying will not help.
+                error = str(e)
+                break
+
+        return {
+            "chat_id": chat_id,
+            "delivered": False,
+            "attempts": attempt,
+            "error": error,
+        }
+
+
+_sender: Optional[NotificationSender] = None
+
+
+def get_notification_sender() -> NotificationSender:
+    """Return the notification sender of the current process."""
+    global _sender
+    if _sender is None:
+        from telegrambot.bot import bot
+
+        _sender = NotificationSender(
+            bot,
+            global_rate=env.float("TELEGRAM_GLOBAL_RATE", 25),
+            per_chat_rate=env.float("TELEGRAM_PER_CHAT_RATE", 1),
+        )
+    return _sender
+
+
+def close_notification_sender() -> None:
+    """Close the notification sender of the current process, if any."""
+    global _sender
+    if _sender is not None:
+        _sender.close()
+        _sender = None
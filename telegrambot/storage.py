@@ -0,0 +1,71 @@
+import json
+from datetime import date
+from typing import Any
+
+from aiogram.fsm.storage.base import BaseEventIsolation, BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage, SimpleEventIsolation
+from aiogram.fsm.storage.redis import RedisStorage
+from environs import Env
+
+env = Env()
+env.read_env()
+
+# FSM data fields holding dates, stored as day ordinals
+DATE_FIELDS = frozenset(("start_date", "end_date"))
+
+
+def dumps_state_data(data: dict[str, Any]) -> str:
+    """Serialize FSM data compactly, the dates as day ordinals."""
+    return json.dumps(
+        {
+            key: (
+                value.toordinal()
+                if key in DATE_FIELDS and isinstance(value, date)
+                else value
+            )
+            for key, value in data.items()
+        },
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+
+
+def loads_state_data(value: str | bytes) -> dict[str, Any]:
+    """Deserialize FSM data written by dumps_state_data."""
+    return {
+        key: (
+            date.fromordinal(item)
+            if key in DATE_FIELDS and isinstance(item, int)
+            else item
+        )
+        for key, item in json.loads(value).items()
+    }
+
+
+def create_storage() -> tuple[BaseStorage, BaseEventIsolation]:
+    """
+    Return the FSM storage selected by FSM_STORAGE and its event isolation.
+    "redis" keeps the conversations in Redis so that they survive restarts
+    and are shared by the bot processes, with a lock per conversation, and
+    abandoned conversations expire after FSM_TTL seconds. "memory" keeps
+    them in the process (for development).
+    """
+    backend = env.str("FSM_STORAGE", "memory")
+    if backend == "memory":
+        return MemoryStorage(), SimpleEventIsolation()
+    if backend != "redis":
+        raise ValueError(f"Unknown FSM storage: {backend}")
+
+    ttl = env.int("FSM_TTL", 86400)
+    storage = RedisStorage.from_url(
+        "redis://{host}:{port}/{db}".format(
+            host=env.str("REDIS_HOST", "127.0.0.1"),
+            port=env.str("REDIS_PORT", "6379"),
+            db=env.int("REDIS_FSM_DB", 2),
+        ),
+        state_ttl=ttl,
+        data_ttl=ttl,
+        json_loads=loads_state_data,
+        json_dumps=dumps_state_data,
+    )
+    return storage, storage.create_isolation()
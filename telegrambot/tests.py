@@ -1,3 +1,238 @@
-from django.test import TestCase
+import asyncio
+import json
+import time
+from datetime import date
+from unittest import mock
 
-# Create your tests here.
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from django.test import SimpleTestCase
+
+from telegrambot.client import ApiClient, CircuitBreaker
+from telegrambot.middlewares import ThrottlingMiddleware
+from telegrambot.notifier import TokenBucket
+from telegrambot.storage import (
+    create_storage,
+    dumps_state_data,
+    loads_state_data,
+)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_open_half_open_and_closed_again(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        with mock.patch("telegrambot.client.time.monotonic") as monotonic:
+            monotonic.return_value = 100
+            breaker.record_failure()
+            self.assertTrue(breaker.allow_request())
+            breaker.record_failure()
+            self.assertTrue(breaker.is_open)
+            self.assertFalse(breaker.allow_request())
+
+            # Half-open: a single trial call is let through
+            monotonic.return_value = 130
+            self.assertTrue(breaker.allow_request())
+            self.assertFalse(breaker.allow_request())
+
+            breaker.record_success()
+            self.assertFalse(breaker.is_open)
+            self.assertTrue(breaker.allow_request())
+
+    def test_failed_trial_opens_the_circuit_again(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        with mock.patch("telegrambot.client.time.monotonic") as monotonic:
+            monotonic.return_value = 100
+            breaker.record_failure()
+            monotonic.return_value = 130
+            self.assertTrue(breaker.allow_request())
+            breaker.record_failure()
+            self.assertFalse(breaker.allow_request())
+
+
+class ApiClientTests(SimpleTestCase):
+    @staticmethod
+    def make_server(handler) -> TestServer:
+        app = web.Application()
+        app.router.add_route("*", "/{endpoint}/", handler)
+        return TestServer(app)
+
+    async def test_only_idempotent_requests_are_retried(self):
+        calls = []
+
+        async def failing(request):
+            calls.append(request.method)
+            return web.json_response({}, status=503)
+
+        async with self.make_server(failing) as server:
+            client = ApiClient(
+                str(server.make_url("")),
+                retries=2,
+                backoff=0,
+                breaker=CircuitBreaker(failure_threshold=100),
+            )
+            try:
+                self.assertIsNone(await client.request("POST", "submit", {}))
+                self.assertEqual(calls, ["POST"])
+
+                calls.clear()
+                self.assertIsNone(
+                    await client.request(
+                        "POST", "submit", {"idempotency_key": "1"}
+                    )
+                )
+                self.assertEqual(calls, ["POST"] * 3)
+
+                calls.clear()
+                self.assertIsNone(await client.request("GET", "list", {}))
+                self.assertEqual(calls, ["GET"] * 3)
+            finally:
+                await client.close()
+
+    async def test_cancelled_trial_frees_the_trial_slot(self):
+        async def handler(request):
+            if request.match_info["endpoint"] == "slow":
+                await asyncio.sleep(10)
+            return web.json_response({"ok": True})
+
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        async with self.make_server(handler) as server:
+            client = ApiClient(str(server.make_url("")), breaker=breaker)
+            try:
+                trial = asyncio.create_task(client.request("GET", "slow", {}))
+                await asyncio.sleep(0.1)
+                self.assertFalse(breaker.allow_request())
+                trial.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await trial
+
+                self.assertEqual(
+                    await client.request("GET", "fast", {}), {"ok": True}
+                )
+                self.assertFalse(breaker.is_open)
+            finally:
+                await client.close()
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_try_acquire_takes_the_burst_then_refills(self):
+        with mock.patch("telegrambot.notifier.time.monotonic") as monotonic:
+            monotonic.return_value = 100
+            bucket = TokenBucket(rate=2, capacity=3)
+            self.assertEqual(
+                [bucket.try_acquire() for _ in range(4)],
+                [True, True, True, False],
+            )
+
+            # Half a second gives one token back, never more than capacity
+            monotonic.return_value = 100.5
+            self.assertTrue(bucket.try_acquire())
+            self.assertFalse(bucket.try_acquire())
+            monotonic.return_value = 200
+            self.assertEqual(bucket.tokens, 0)
+            bucket.try_acquire()
+            self.assertEqual(bucket.tokens, 2)
+
+    async def test_acquire_spreads_the_calls_over_the_rate(self):
+        bucket = TokenBucket(rate=20, capacity=2)
+
+        started = time.monotonic()
+        for _ in range(4):
+            await bucket.acquire()
+        elapsed = time.monotonic() - started
+
+        # The burst is free, the two other tokens take 1/20 s each
+        self.assertGreaterEqual(elapsed, 0.09)
+        self.assertLess(elapsed, 0.5)
+
+    async def test_concurrent_acquires_share_the_rate(self):
+        bucket = TokenBucket(rate=20)
+
+        started = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(3)))
+
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+
+class ThrottlingMiddlewareTests(SimpleTestCase):
+    @staticmethod
+    def message_from(user_id: int):
+        event = mock.Mock()
+        event.answer = mock.AsyncMock()
+        return event, {"event_from_user": mock.Mock(id=user_id)}
+
+    async def test_user_over_the_burst_is_answered_busy_once(self):
+        middleware = ThrottlingMiddleware(rate=1, burst=2)
+        handler = mock.AsyncMock(return_value="handled")
+        event, data = self.message_from(1)
+
+        with mock.patch("telegrambot.notifier.time.monotonic", return_value=0):
+            results = [
+                await middleware(handler, event, data) for _ in range(4)
+            ]
+            # Another user has a bucket of their own
+            other = await middleware(handler, *self.message_from(2))
+
+        self.assertEqual(results, ["handled", "handled", None, None])
+        self.assertEqual(other, "handled")
+        event.answer.assert_awaited_once_with(middleware.busy_text)
+        self.assertEqual(
+            middleware.stats(),
+            {"in_flight": 0, "handled": 3, "throttled": 2, "dropped": 0},
+        )
+
+    async def test_messages_over_max_in_flight_are_dropped(self):
+        middleware = ThrottlingMiddleware(max_in_flight=1)
+        release = asyncio.Event()
+
+        async def handler(event, data):
+            await release.wait()
+            return "handled"
+
+        first = asyncio.create_task(middleware(handler, *self.message_from(1)))
+        await asyncio.sleep(0)
+        event, data = self.message_from(2)
+        self.assertIsNone(await middleware(handler, event, data))
+        event.answer.assert_awaited_once()
+
+        release.set()
+        self.assertEqual(await first, "handled")
+        self.assertEqual(middleware.stats()["dropped"], 1)
+        self.assertEqual(middleware.in_flight, 0)
+
+
+class StateDataTests(SimpleTestCase):
+    def test_dates_round_trip_as_ordinals(self):
+        data = {
+            "start_date": date(2031, 3, 1),
+            "end_date": date(2031, 3, 6),
+            "comment": "Отпуск",
+            "leave_type": 3,
+        }
+
+        dumped = dumps_state_data(data)
+
+        self.assertEqual(
+            json.loads(dumped)["start_date"], date(2031, 3, 1).toordinal()
+        )
+        self.assertIn("Отпуск", dumped)
+        self.assertNotIn(", ", dumped)
+        self.assertNotIn(": ", dumped)
+        self.assertEqual(loads_state_data(dumped), data)
+
+    def test_only_the_date_fields_are_converted(self):
+        data = {"leave_type": 738000, "start_date": None}
+        self.assertEqual(loads_state_data(dumps_state_data(data)), data)
+        self.assertEqual(
+            loads_state_data(b'{"end_date": 5}')["end_date"], date(1, 1, 5)
+        )
+
+    def test_storage_is_chosen_by_the_environment(self):
+        with mock.patch.dict("os.environ", {"FSM_STORAGE": "memory"}):
+            storage, _isolation = create_storage()
+        self.assertIsInstance(storage, MemoryStorage)
+
+        with mock.patch.dict("os.environ", {"FSM_STORAGE": "disk"}):
+            with self.assertRaises(ValueError):
+                create_storage()
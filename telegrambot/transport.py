@@ -0,0 +1,279 @@
+import hashlib
+import hmac
+import logging
+import os
+import re
+import time
+from typing import Any, Callable, Optional
+
+from asgiref.sync import sync_to_async
+
+from telegrambot.cache import TTLCache
+from telegrambot.client import ApiAuthenticationError, ApiClient
+
+logger = logging.getLogger(__name__)
+
+
+def compute_hmac_hash(params: dict[str, Any], secret: str) -> str:
+    """Compute the HMAC hash for the given params."""
+
+    data_check_string = "\n".join(
+        f"{k}={v}" for k, v in sorted(params.items())
+    )
+    secret_key = hashlib.sha256(secret.encode()).digest()
+    computed_hash = hmac.new(
+        secret_key, data_check_string.encode(), hashlib.sha256
+    ).hexdigest()
+    return computed_hash
+
+
+class HttpTransport:
+    """
+    Sends the bot requests to the staff API over HTTP.
+    The signed Telegram payload is exchanged once per user for an API token
+    which is then sent as a Bearer header. A token rejected by the API (it
+    expired early or the user changed) is dropped and exchanged again once.
+    Without a token the request is signed the old way.
+    """
+
+    def __init__(self, client: ApiClient, secret: str, token_ttl: float):
+        self.client = client
+        self.secret = secret
+        # API tokens by telegram id, kept for less than the API issues them
+        self._tokens = TTLCache(maxsize=10_000, ttl=token_ttl)
+
+    async def start(self) -> None:
+        await self.client.start()
+
+    async def close(self) -> None:
+        await self.client.close()
+
+    async def get_api_token(self, telegram_id: int) -> Optional[str]:
+        """Return the API token of the user, exchanging a signed payload."""
+        found, token = self._tokens.get(telegram_id)
+        if found:
+            return token
+
+        params = {"telegram_id": telegram_id, "auth_date": int(time.time())}
+        response = await self.client.request(
+            "POST",
+            "auth/telegram-token",
+            {**params, "hash": compute_hmac_hash(params, self.secret)},
+        )
+        if not response:
+            return None
+        self._tokens.set(telegram_id, response["token"])
+        return response["token"]
+
+    async def request(
+        self, method: str, endpoint: str, params: dict[str, Any]
+    ) -> Optional[Any]:
+        telegram_id = params.get("telegram_id")
+        token = (
+            await self.get_api_token(telegram_id)
+            if telegram_id is not None
+            else None
+        )
+        for attempt in range(2):
+            if not token:
+                break
+            try:
+                return await self.client.request(
+                    method,
+                    endpoint,
+                    params,
+                    headers={"Authorization": f"Bearer {token}"},
+                    raise_auth_errors=True,
+                )
+            except ApiAuthenticationError as error:
+                self._tokens.delete(telegram_id)
+                if attempt:
+                    logger.error("Error fetching data: %s", error)
+                    return None
+                token = await self.get_api_token(telegram_id)
+
+        payload = {**params, "hash": compute_hmac_hash(params, self.secret)}
+        return await self.client.request(method, endpoint, payload)
+
+
+class OrmTransport:
+    """
+    Serves the bot requests in process when the bot runs next to Django.
+    Every endpoint is answered by the services and serializers of the API
+    views, run through sync_to_async, so the validation and the responses
+    are the same without the HTTP round trip, the JSON encoding and the
+    signatures. The user is identified by the telegram id of the params.
+    Like ApiClient.request, failed requests are logged and return None.
+    """
+
+    DETAIL_ENDPOINT = re.compile(r"leave-requests/(?P<pk>\d+)/(?P<action>\w+)")
+
+    def __init__(self):
+        self._routes: dict[tuple[str, str], Callable[..., Any]] = {
+            ("GET", "leave-type"): self._leave_types,
+            ("GET", "leave-requests"): self._leave_requests,
+            ("POST", "leave-requests"): self._create_leave_request,
+            ("POST", "leave-requests/submit"): self._submit_leave_request,
+            (
+                "GET",
+                "leave-requests/telegram_is_employee",
+            ): self._telegram_is_employee,
+            ("GET", "leave-requests/check_overlap"): self._check_overlap,
+            (
+                "POST",
+                "leave-requests/save_and_submit",
+            ): self._save_and_submit,
+        }
+
+    async def start(self) -> None:
+        import django
+
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
+        await sync_to_async(django.setup)()
+
+    async def close(self) -> None:
+        from django.db import close_old_connections
+
+        await sync_to_async(close_old_connections)()
+
+    async def request(
+        self, method: str, endpoint: str, params: dict[str, Any]
+    ) -> Optional[Any]:
+        kwargs = {}
+        match = self.DETAIL_ENDPOINT.fullmatch(endpoint)
+        if match:
+            endpoint = f"leave-requests/{match['action']}"
+            kwargs["pk"] = int(match["pk"])
+
+        handler = self._routes.get((method, endpoint))
+        if handler is None:
+            logger.error("Unsupported API request: %s %s", method, endpoint)
+            return None
+        return await sync_to_async(self._call)(handler, params, **kwargs)
+
+    @staticmethod
+    def _call(handler, params: dict[str, Any], **kwargs) -> Optional[Any]:
+        from django.core.exceptions import (
+            ObjectDoesNotExist,
+            PermissionDenied,
+            ValidationError,
+        )
+        from django.db import IntegrityError, close_old_connections
+        from django.http import Http404
+        from rest_framework.exceptions import APIException
+
+        # Like a request would, drop the connections past their lifetime
+        close_old_connections()
+        try:
+            return handler(params, **kwargs)
+        except (
+            APIException,
+            Http404,
+            IntegrityError,
+            ObjectDoesNotExist,
+            PermissionDenied,
+            ValidationError,
+        ) as error:
+            # The errors answered with a 4xx status over HTTP
+            logger.error("Error fetching data: %s", error)
+            return None
+        except Exception as error:
+            # A 5xx status over HTTP
+            logger.exception("An error occurred: %s", error)
+            return None
+
+    @staticmethod
+    def _get_employee(params: dict[str, Any]):
+        from staff.models import Employee
+
+        # Like the API, which only issues tokens to active employees
+        return Employee.objects.get(
+            telegram_id=params.get("telegram_id"), is_active=True
+        )
+
+    @staticmethod
+    def _leave_types(params: dict[str, Any]) -> list:
+        from vacation.serializers import VacationLeaveTypeSerializer
+        from vacation.services import get_requestable_leave_types
+
+        return VacationLeaveTypeSerializer(
+            get_requestable_leave_types(), many=True
+        ).data
+
+    def _leave_requests(self, params: dict[str, Any]) -> dict:
+        """
+        The first page of the leave requests of the user. As there are no
+        page links in process, "next" only tells whether there are more.
+        """
+        from vacation.pagination import LeaveRequestCursorPagination
+        from vacation.serializers import LeaveRequestUserSerializer
+        from vacation.services import get_user_leave_requests
+
+        page_size = LeaveRequestCursorPagination.page_size
+        leave_requests = list(
+            get_user_leave_requests(self._get_employee(params).pk).order_by(
+                *LeaveRequestCursorPagination.ordering
+            )[: page_size + 1]
+        )
+        return {
+            "next": True if len(leave_requests) > page_size else None,
+            "previous": None,
+            "results": LeaveRequestUserSerializer(
+                leave_requests[:page_size],
+                many=True,
+                context={"fields": params.get("fields")},
+            ).data,
+        }
+
+    def _create_leave_request(self, params: dict[str, Any]) -> dict:
+        from vacation.serializers import LeaveRequestUserSerializer
+
+        return self._save_leave_request(LeaveRequestUserSerializer, params)
+
+    def _submit_leave_request(self, params: dict[str, Any]) -> dict:
+        from vacation.serializers import LeaveRequestSubmitSerializer
+
+        return self._save_leave_request(
+            LeaveRequestSubmitSerializer, params, submit=True
+        )
+
+    def _save_leave_request(
+        self, serializer_class, params: dict[str, Any], submit: bool = False
+    ) -> dict:
+        from vacation.services import create_leave_request
+
+        employee = self._get_employee(params)
+        leave_request, _created = create_leave_request(
+            serializer_class(data=params, context={"employee": employee}),
+            employee.pk,
+            submit=submit,
+        )
+        return serializer_class(leave_request).data
+
+    @staticmethod
+    def _telegram_is_employee(params: dict[str, Any]) -> dict:
+        from vacation.services import is_telegram_employee
+
+        return {"status": is_telegram_employee(params.get("telegram_id"))}
+
+    def _check_overlap(self, params: dict[str, Any]) -> dict:
+        from vacation.services import describe_overlapping_requests
+
+        return describe_overlapping_requests(
+            self._get_employee(params).pk,
+            params.get("start_date"),
+            params.get("end_date"),
+        )
+
+    def _save_and_submit(self, params: dict[str, Any], pk: int) -> dict:
+        from django.utils.translation import gettext as _
+
+        from vacation.services import (
+            get_user_leave_requests,
+            submit_leave_request,
+        )
+
+        submit_leave_request(
+            get_user_leave_requests(self._get_employee(params).pk).get(pk=pk)
+        )
+        return {"status": _("Leave request submitted for approval")}
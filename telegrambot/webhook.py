@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+import sys
+from typing import Any
+from urllib.parse import urlsplit
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import (
+    SimpleRequestHandler,
+    setup_application,
+)
+from aiohttp import web
+from environs import Env
+
+logger = logging.getLogger(__name__)
+
+env = Env()
+env.read_env()
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """
+    Webhook handler answering Telegram at once and processing the update in
+    the background, with at most `max_concurrency` updates in flight.
+    When every slot is busy the response is delayed, so Telegram (which keeps
+    at most `max_connections` requests open) slows down instead of the
+    pending tasks piling up. On shutdown the running updates are awaited for
+    up to `shutdown_timeout` seconds before the bot session is closed.
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        secret_token: str,
+        max_concurrency: int = 100,
+        shutdown_timeout: float = 10,
+        **data: Any,
+    ):
+        super().__init__(
+            dispatcher,
+            bot,
+            handle_in_background=True,
+            secret_token=secret_token,
+            **data,
+        )
+        self.shutdown_timeout = shutdown_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _handle_request_background(
+        self, bot: Bot, request: web.Request
+    ) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        await self._semaphore.acquire()
+        task = asyncio.create_task(
+            self._background_feed_update(bot=bot, update=update)
+        )
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._feed_update_done)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    def _feed_update_done(self, task: asyncio.Task) -> None:
+        self._background_feed_update_tasks.discard(task)
+        self._semaphore.release()
+
+    async def close(self) -> None:
+        if self._background_feed_update_tasks:
+            await asyncio.wait(
+                self._background_feed_update_tasks,
+                timeout=self.shutdown_timeout,
+            )
+        await super().close()
+
+
+def webhook_path() -> str:
+    """Return the path of the webhook URL the server listens on."""
+    return urlsplit(env.str("WEBHOOK_URL")).path or "/"
+
+
+async def set_webhook(dispatcher: Dispatcher, bot: Bot) -> None:
+    """Register the webhook URL and the secret token in Telegram."""
+    await bot.set_webhook(
+        env.str("WEBHOOK_URL"),
+        secret_token=env.str("WEBHOOK_SECRET"),
+        max_connections=env.int("WEBHOOK_MAX_CONNECTIONS", 40),
+        allowed_updates=dispatcher.resolve_used_update_types(),
+    )
+    # The session belongs to this event loop, the workers open their own
+    await bot.session.close()
+
+
+def serve_webhook(dispatcher: Dispatcher, bot: Bot, reuse_port: bool) -> None:
+    """Run one webhook server until it is stopped by a signal."""
+    app = web.Application()
+    BoundedRequestHandler(
+        dispatcher,
+        bot,
+        secret_token=env.str("WEBHOOK_SECRET"),
+        max_concurrency=env.int("WEBHOOK_MAX_CONCURRENCY", 100),
+    ).register(app, path=webhook_path())
+    setup_application(app, dispatcher, bot=bot)
+    web.run_app(
+        app,
+        host=env.str("WEBHOOK_HOST", "0.0.0.0"),
+        port=env.int("WEBHOOK_PORT", 8080),
+        reuse_port=reuse_port,
+        print=None,
+    )
+
+
+def run_webhook(dispatcher: Dispatcher, bot: Bot) -> None:
+    """
+    Register the webhook and serve it with WEBHOOK_WORKERS processes.
+    The workers share the port (SO_REUSEPORT) and the kernel spreads the
+    Telegram connections between them. Stopping the parent stops them all.
+    """
+    asyncio.run(set_webhook(dispatcher, bot))
+
+    workers = env.int("WEBHOOK_WORKERS", 1)
+    if workers > 1 and isinstance(dispatcher.storage, MemoryStorage):
+        logger.warning(
+            "Conversations are kept per worker, set FSM_STORAGE=redis"
+        )
+    if workers <= 1:
+        serve_webhook(dispatcher, bot, reuse_port=False)
+        return
+
+    # Raise SystemExit on SIGTERM so that the workers are stopped below
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(
+            target=serve_webhook,
+            args=(dispatcher, bot, True),
+            name=f"webhook-{number}",
+        )
+        for number in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    logger.info("Started %s webhook workers", workers)
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
@@ -1,15 +1,22 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.utils.translation import gettext_lazy as _
 from simple_history.admin import SimpleHistoryAdmin
 
 from common.admin import BaseAdmin
-from common.enums import StatusRequestChoices
-from vacation.models import LeaveRequest, VacationUsed, LeaveType
+from common.enums import OutboxStatusChoices, StatusRequestChoices
+from vacation.models import (
+    LeaveRequest,
+    VacationBalance,
+    LeaveType,
+    NotificationOutbox,
+    RolloverCheckpoint,
+)
+from vacation.services import check_leave_request_capacity
 
 
-@admin.register(VacationUsed)
-class VacationUsedAdmin(BaseAdmin):
-    """This admin is used to manage the installation of Vacation"""
+@admin.register(VacationBalance)
+class VacationBalanceAdmin(BaseAdmin):
+    """Admin interface for the vacation balances."""
 
     def has_add_permission(self, request):
         """Disable the ability to add new entries"""
@@ -19,24 +26,36 @@ class VacationUsedAdmin(BaseAdmin):
         """Disable the ability to change"""
         return False
 
-    # def has_delete_permission(self, request, obj=None):
-    #     """Disable the ability to delete"""
-    #     return False
-
     list_display = (
         "employee",
-        "days",
+        "year",
+        "leave_type",
+        "allowance_days",
+        "used_days",
+        "remaining_days",
+    )
+    list_select_related = ("employee", "leave_type")
+    list_filter = ("year", "leave_type", "employee")
+    search_fields = ("employee__username",)
+    readonly_fields = (
+        "employee",
+        "year",
+        "leave_type",
+        "allowance_days",
+        "used_days",
+        "remaining_days",
     )
-    list_filter = ("employee",)
-    search_fields = ("employee",)
-    readonly_fields = ("employee", "days")
     fieldsets = (
         (
             _("Information"),
             {
                 "fields": (
                     "employee",
-                    "days",
+                    "year",
+                    "leave_type",
+                    "allowance_days",
+                    "used_days",
+                    "remaining_days",
                 )
             },
         ),
@@ -53,6 +72,25 @@ class LeaveRequestAdmin(BaseAdmin, SimpleHistoryAdmin):
             readonly_fields += ("status",)
         return readonly_fields
 
+    def save_model(self, request, obj, form, change):
+        """Warn when the approval leaves the team of the employee short."""
+        super().save_model(request, obj, form, change)
+        if (
+            obj.status == StatusRequestChoices.APPROVED
+            and "status" in form.changed_data
+        ):
+            capacity = check_leave_request_capacity(obj)
+            if capacity and capacity["breach"]:
+                messages.warning(
+                    request,
+                    _(
+                        "%(peak)s of %(team_size)s employees with the job "
+                        "title '%(job_title)s' are away at the same time "
+                        "on %(peak_date)s."
+                    )
+                    % capacity,
+                )
+
     list_display = (
         "employee",
         "leave_type",
@@ -114,6 +152,7 @@ class LeaveTypeAdmin(BaseAdmin):
     list_display = (
         "title",
         "parent",
+        "days_per_year",
     )
     list_display_links = ("title",)
     list_filter = ("parent",)
@@ -127,6 +166,7 @@ class LeaveTypeAdmin(BaseAdmin):
                 "fields": (
                     "title",
                     "parent",
+                    "days_per_year",
                 )
             },
         ),
@@ -139,7 +179,82 @@ class LeaveTypeAdmin(BaseAdmin):
                 "fields": (
                     "title",
                     "parent",
+                    "days_per_year",
                 )
             },
         ),
     ) + BaseAdmin.fieldsets
+
+
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(BaseAdmin):
+    """Admin interface for the notification outbox."""
+
+    def has_add_permission(self, request):
+        """Disable the ability to add new entries"""
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        """Show the delivery backlog above the list."""
+        extra_context = extra_context or {}
+        extra_context["subtitle"] = _("Backlog: %(count)s") % {
+            "count": NotificationOutbox.objects.filter(
+                status=OutboxStatusChoices.PENDING
+            ).count()
+        }
+        return super().changelist_view(request, extra_context=extra_context)
+
+    list_display = (
+        "pk",
+        "leave_request",
+        "status",
+        "attempts",
+        "next_attempt_at",
+        "created_at",
+    )
+    list_filter = ("status",)
+    readonly_fields = (
+        "leave_request",
+        "text",
+        "attempts",
+        "delivered_to",
+        "last_error",
+    ) + BaseAdmin.readonly_fields
+    fieldsets = (
+        (
+            _("Information"),
+            {
+                "fields": (
+                    "leave_request",
+                    "text",
+                    "status",
+                    "attempts",
+                    "next_attempt_at",
+                    "delivered_to",
+                    "last_error",
+                )
+            },
+        ),
+    ) + BaseAdmin.fieldsets
+
+
+@admin.register(RolloverCheckpoint)
+class RolloverCheckpointAdmin(BaseAdmin):
+    """Admin interface for the progress of the year-end rollover."""
+
+    def has_add_permission(self, request):
+        """Disable the ability to add new entries"""
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        """Disable the ability to change"""
+        return False
+
+    list_display = (
+        "year",
+        "stage",
+        "last_pk",
+        "processed",
+        "finished_at",
+        "updated_at",
+    )
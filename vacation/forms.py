@@ -3,7 +3,9 @@ from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from common.enums import UKRAINIAN_MONTHS
+from .leave_types import get_leave_type_tree
 from .models import LeaveRequest, LeaveType
+from .services import find_overlapping_requests
 
 
 class LeaveTypeChoiceField(forms.ModelChoiceField):
@@ -11,31 +13,16 @@ class LeaveTypeChoiceField(forms.ModelChoiceField):
 
     def label_from_instance(self, obj) -> str:
         """Generate a label for the instance that includes its hierarchy."""
-        level = 0
-        parent = obj.parent
-        while parent:
-            level += 1
-            parent = parent.parent
+        tree = get_leave_type_tree()
+        if obj.parent_id is None or obj.parent_id not in tree:
+            return str(obj.title)
 
         # Construct the label showing the hierarchy with '—' characters
         return (
-            str(obj.title)
-            if obj.parent is None
-            else f"{obj.parent} {'—' * level}> {obj.title}"
+            f"{tree.full_title(obj.parent_id)} "
+            f"{'—' * tree.depth(obj.pk)}> {obj.title}"
         )
 
-    def __init__(self, *args, queryset=None, **kwargs):
-        super().__init__(*args, queryset=queryset, **kwargs)
-
-        # If a queryset is provided, filter it to exclude objects with
-        # subtypes if the queryset supports filtering
-        if queryset is not None:
-            self.queryset = (
-                queryset.filter(subtypes__isnull=True)
-                if hasattr(queryset, "filter")
-                else queryset
-            )
-
 
 class LeaveRequestForm(forms.ModelForm):
     """Form for creating and validating leave requests."""
@@ -89,6 +76,13 @@ class LeaveRequestForm(forms.ModelForm):
         self.employee = kwargs.pop("employee", None)
         super().__init__(*args, **kwargs)
 
+        # Exclude leave types with subtypes, the tree is read per form and
+        # not when the module is imported
+        leave_type = self.fields["leave_type"]
+        leave_type.queryset = leave_type.queryset.filter(
+            pk__in=get_leave_type_tree().leaf_ids
+        )
+
     def clean(self) -> dict:
         cleaned_data = super().clean()
         start_date = cleaned_data.get("start_date")
@@ -110,13 +104,14 @@ class LeaveRequestForm(forms.ModelForm):
                     _("Start date cannot be later than current date.")
                 )
             # Check for overlapping leave requests for the employee
-            overlapping_requests = LeaveRequest.objects.filter(
-                employee=self.employee,
-                start_date__lt=end_date,
-                end_date__gt=start_date,
-            ).exclude(pk=self.instance.pk)
+            overlapping_requests = find_overlapping_requests(
+                self.employee,
+                start_date,
+                end_date,
+                exclude_pk=self.instance.pk,
+            )
 
-            if overlapping_requests.exists():
+            if overlapping_requests:
                 overlapping_dates = ", ".join(
                     f"{req.start_date} - {req.end_date}"
                     for req in overlapping_requests
@@ -0,0 +1,87 @@
+import threading
+import time
+from typing import Iterable
+
+from common.cache import bump_namespace_version, get_namespace_version
+
+LEAVE_TYPE_TREE_NAMESPACE = "leave_types"
+# How often a process checks whether another one changed the leave types
+LEAVE_TYPE_TREE_CHECK_INTERVAL = 5
+
+
+class LeaveTypeTree:
+    """Leave types by id with their titles, parents and children."""
+
+    def __init__(self, rows: Iterable[tuple[int, str, int | None]]):
+        self.titles: dict[int, str] = {}
+        self.parents: dict[int, int | None] = {}
+        self.children: dict[int, list[int]] = {}
+        for pk, title, parent_id in rows:
+            self.titles[pk] = title
+            self.parents[pk] = parent_id
+            self.children.setdefault(pk, [])
+            if parent_id is not None:
+                self.children.setdefault(parent_id, []).append(pk)
+        self.leaf_ids = frozenset(
+            pk for pk in self.titles if not self.children[pk]
+        )
+
+    def __contains__(self, pk) -> bool:
+        return pk in self.titles
+
+    def ancestors(self, pk: int) -> list[int]:
+        """Return the ids from the root down to the leave type itself."""
+        chain = []
+        while pk is not None and pk not in chain:
+            chain.append(pk)
+            pk = self.parents.get(pk)
+        return chain[::-1]
+
+    def depth(self, pk: int) -> int:
+        return len(self.ancestors(pk)) - 1
+
+    def full_title(self, pk: int, separator: str = " - ") -> str:
+        """Return the titles of the leave type and its ancestors joined."""
+        return separator.join(self.titles[pk] for pk in self.ancestors(pk))
+
+
+_lock = threading.Lock()
+_tree: LeaveTypeTree | None = None
+_version = None
+_checked_at = 0.0
+
+
+def get_leave_type_tree() -> LeaveTypeTree:
+    """
+    Return the leave type tree of the process.
+    It is loaded with one query and reloaded when the version of the shared
+    namespace changes, which is checked at most every few seconds.
+    """
+    global _tree, _version, _checked_at
+
+    now = time.monotonic()
+    tree = _tree
+    if tree is not None and now - _checked_at < LEAVE_TYPE_TREE_CHECK_INTERVAL:
+        return tree
+
+    with _lock:
+        tree = _tree
+        version = get_namespace_version(LEAVE_TYPE_TREE_NAMESPACE)
+        if tree is None or version != _version:
+            from vacation.models import LeaveType
+
+            tree = LeaveTypeTree(
+                LeaveType.objects.order_by("path", "pk").values_list(
+                    "pk", "title", "parent_id"
+                )
+            )
+            _tree, _version = tree, version
+        _checked_at = now
+    return tree
+
+
+def invalidate_leave_type_tree() -> None:
+    """Drop the leave type tree of every process."""
+    global _tree
+    bump_namespace_version(LEAVE_TYPE_TREE_NAMESPACE)
+    _tree = None
@@ -0,0 +1,116 @@
+import random
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from common.enums import StatusRequestChoices
+from staff.models import Employee
+from vacation.models import LeaveRequest, LeaveType
+from vacation.services import find_capacity_conflicts, max_concurrent_absences
+
+
+class _Rollback(Exception):
+    """Raised to roll back the synthetic benchmark data."""
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the team capacity calculation on synthetic leave requests. "
+        "The synthetic data is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=100_000,
+            help="Number of synthetic approved leave requests.",
+        )
+        parser.add_argument(
+            "--employees",
+            type=int,
+            default=2000,
+            help="Number of synthetic employees.",
+        )
+        parser.add_argument(
+            "--job-titles",
+            type=int,
+            default=20,
+            help="Number of job titles the employees are spread over.",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+
+    def handle(self, *args, **options):
+        leave_type = LeaveType.objects.first()
+        if leave_type is None:
+            self.stderr.write("No leave types found, run migrations first.")
+            return
+
+        random.seed(options["seed"])
+        try:
+            with transaction.atomic():
+                self._run(leave_type, options)
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _run(self, leave_type, options):
+        start = date(2000, 1, 1)
+        # Spread the requests so that every employee has a few per year
+        span = max(options["requests"] // options["employees"] * 20, 365)
+
+        periods = [
+            (day, day + timedelta(days=random.randint(1, 14)))
+            for day in (
+                start + timedelta(days=random.randrange(span))
+                for _ in range(options["requests"])
+            )
+        ]
+
+        started = time.perf_counter()
+        peak, peak_date = max_concurrent_absences(periods)
+        elapsed = (time.perf_counter() - started) * 1000
+        self.stdout.write(
+            f"sweep of {len(periods)} periods: {elapsed:.1f} ms "
+            f"(peak {peak} on {peak_date})"
+        )
+
+        employees = Employee.objects.bulk_create(
+            Employee(
+                username=f"__benchmark_capacity_{index}__",
+                job_title=f"title {index % options['job_titles']}",
+            )
+            for index in range(options["employees"])
+        )
+        LeaveRequest.objects.bulk_create(
+            (
+                LeaveRequest(
+                    employee=random.choice(employees),
+                    leave_type=leave_type,
+                    start_date=start_date,
+                    end_date=end_date,
+                    number_of_days=(end_date - start_date).days,
+                    status=StatusRequestChoices.APPROVED,
+                )
+                for start_date, end_date in periods
+            ),
+            batch_size=5000,
+        )
+
+        end = start + timedelta(days=span + 14)
+        started = time.perf_counter()
+        conflicts = find_capacity_conflicts(start, end)
+        elapsed = (time.perf_counter() - started) * 1000
+        breaches = sum(conflict["breach"] for conflict in conflicts)
+        self.stdout.write(
+            f"capacity report of {len(conflicts)} job titles: "
+            f"{elapsed:.1f} ms ({breaches} breaches)"
+        )
+
+        job_title = employees[0].job_title
+        started = time.perf_counter()
+        find_capacity_conflicts(start, start + timedelta(days=30), job_title)
+        elapsed = (time.perf_counter() - started) * 1000
+        self.stdout.write(f"approval check of one month: {elapsed:.1f} ms")
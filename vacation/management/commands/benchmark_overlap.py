@@ -0,0 +1,91 @@
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from common.enums import StatusRequestChoices
+from staff.models import Employee
+from vacation.models import LeaveRequest, LeaveType
+from vacation.services import find_overlapping_requests
+
+
+class _Rollback(Exception):
+    """Raised to roll back the synthetic benchmark data."""
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the overlap lookup against a growing leave history. "
+        "The synthetic data is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=[10, 100, 1000, 5000],
+            help="History sizes (rows per employee) to measure.",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=200,
+            help="Number of lookups per history size.",
+        )
+
+    def handle(self, *args, **options):
+        leave_type = LeaveType.objects.first()
+        if leave_type is None:
+            self.stderr.write("No leave types found, run migrations first.")
+            return
+
+        try:
+            with transaction.atomic():
+                self._run(leave_type, options["sizes"], options["repeat"])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _run(self, leave_type, sizes, repeat):
+        employee = Employee.objects.create(username="__benchmark_overlap__")
+        start = date(2000, 1, 1)
+        created = 0
+
+        self.stdout.write(f"{'rows':>8} {'avg ms':>10} {'found':>6}")
+        for size in sorted(sizes):
+            # Non-overlapping two-day requests with a gap of one day
+            LeaveRequest.objects.bulk_create(
+                LeaveRequest(
+                    employee=employee,
+                    leave_type=leave_type,
+                    start_date=start + timedelta(days=3 * i),
+                    end_date=start + timedelta(days=3 * i + 2),
+                    number_of_days=2,
+                    status=StatusRequestChoices.APPROVED,
+                )
+                for i in range(created, size)
+            )
+            created = max(created, size)
+
+            # Probe a day in the middle of the history
+            probe = start + timedelta(days=3 * (created // 2) + 1)
+            started = time.perf_counter()
+            for _ in range(repeat):
+                found = find_overlapping_requests(
+                    employee, probe, probe + timedelta(days=1)
+                )
+            elapsed = (time.perf_counter() - started) / repeat * 1000
+            self.stdout.write(f"{created:>8} {elapsed:>10.3f} {len(found):>6}")
+
+        if connection.vendor == "sqlite":
+            sql, params = LeaveRequest.objects.filter(
+                employee=employee,
+                start_date__lte=probe,
+                end_date__gt=probe,
+            ).query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+                for row in cursor.fetchall():
+                    self.stdout.write(f"plan: {row[-1]}")
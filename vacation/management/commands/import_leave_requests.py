@@ -0,0 +1,277 @@
+import csv
+import json
+import time
+from bisect import bisect_left
+from datetime import date
+from itertools import islice
+from pathlib import Path
+from typing import Iterator
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from simple_history.utils import bulk_create_with_history
+
+from common.enums import StatusRequestChoices
+from staff.models import Employee
+from vacation.models import LeaveRequest, LeaveType
+from vacation.services import (
+    invalidate_availability,
+    invalidate_org_dashboard,
+    invalidate_user_dashboard,
+    recompute_vacation_balances,
+)
+
+
+class RowError(Exception):
+    """Raised when an imported row cannot be turned into a leave request."""
+
+
+def sweep_overlaps(existing, candidates) -> set[int]:
+    """
+    Find the candidates that overlap each other or the existing periods.
+    Both lists hold (start_date, end_date, ...) tuples, a period ends on the
+    day before its end date like in find_overlapping_requests. Every candidate is first checked against the existing
+    periods, merged and sorted, with a binary search. The candidates left
+    are then swept by start date, each one is rejected if it overlaps a
+    candidate kept before it.
+    Returns the indexes of the rejected candidates.
+    """
+    # Merge the existing periods into sorted disjoint ones
+    starts = []
+    ends = []
+    for start, end in sorted(existing):
+        if ends and start <= ends[-1]:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+
+    rejected = set()
+    remaining = []
+    for index, row in enumerate(candidates):
+        start, end = row[0], row[1]
+        # The last existing period starting before the end of the candidate
+        position = bisect_left(starts, end) - 1
+        if position >= 0 and ends[position] > start:
+            rejected.add(index)
+        else:
+            remaining.append((start, end, index))
+
+    kept_end = None  # The furthest end date of the kept candidates
+    for start, end, index in sorted(remaining):
+        if kept_end is not None and start < kept_end:
+            rejected.add(index)
+        else:
+            kept_end = end if kept_end is None else max(kept_end, end)
+
+    return rejected
+
+
+class Command(BaseCommand):
+    help = (
+        "Import leave requests from a CSV or JSONL file in chunks. "
+        "Expected fields: employee (username), leave_type (id or title), "
+        "start_date, end_date (YYYY-MM-DD) and optional status, comment, "
+        "expired."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", type=Path, help="File to import.")
+        parser.add_argument(
+            "--format",
+            choices=("csv", "jsonl"),
+            help="File format, detected from the extension by default.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of rows validated and inserted at once.",
+        )
+        parser.add_argument(
+            "--errors",
+            type=Path,
+            help="CSV file for the rejected rows "
+            "(default: <path>.errors.csv).",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not path.exists():
+            raise CommandError(f"File {path} does not exist.")
+
+        file_format = options["format"] or path.suffix.lstrip(".").lower()
+        if file_format not in ("csv", "jsonl"):
+            raise CommandError("Unknown file format, use --format.")
+
+        errors_path = options["errors"] or path.with_suffix(
+            path.suffix + ".errors.csv"
+        )
+
+        self.employees = dict(Employee.objects.values_list("username", "pk"))
+        self.leave_types = {}
+        for pk, title in LeaveType.objects.values_list("pk", "title"):
+            self.leave_types[str(pk)] = pk
+            self.leave_types[title] = pk
+        # employee_id -> periods already stored or accepted
+        self.periods = {}
+
+        imported = rejected = 0
+        started = time.perf_counter()
+
+        with path.open(newline="", encoding="utf-8") as source, open(
+            errors_path, "w", newline="", encoding="utf-8"
+        ) as errors_file:
+            errors = csv.writer(errors_file)
+            errors.writerow(("line", "error", "row"))
+
+            rows = self._read_rows(source, file_format)
+            while chunk := list(islice(rows, options["chunk_size"])):
+                chunk_imported, chunk_errors = self._import_chunk(chunk)
+                imported += chunk_imported
+                rejected += len(chunk_errors)
+                errors.writerows(chunk_errors)
+
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f"Imported {imported}, rejected {rejected} "
+                    f"({(imported + rejected) / elapsed:.0f} rows/s)"
+                )
+
+        # Vacation balances are recalculated once for all the employees
+        recompute_vacation_balances(self.periods)
+        for employee_id in self.periods:
+            invalidate_user_dashboard(employee_id)
+        invalidate_org_dashboard()
+        invalidate_availability()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Done in {elapsed:.1f}s: {imported} imported, "
+                f"{rejected} rejected "
+                f"({(imported + rejected) / max(elapsed, 1e-9):.0f} rows/s)."
+            )
+        )
+        if rejected:
+            self.stdout.write(f"Rejected rows were written to {errors_path}")
+
+    @staticmethod
+    def _read_rows(source, file_format) -> Iterator[tuple[int, dict]]:
+        """Yield (line number, row) pairs from the file."""
+        if file_format == "csv":
+            reader = csv.DictReader(source)
+            for row in reader:
+                yield reader.line_num, row
+            return
+
+        for line_number, line in enumerate(source, start=1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_number, {"__error__": str(e), "raw": line}
+
+    def _parse_row(self, row: dict) -> LeaveRequest:
+        """Build an unsaved leave request from the row."""
+        if "__error__" in row:
+            raise RowError(row["__error__"])
+
+        employee_id = self.employees.get(str(row.get("employee", "")))
+        if employee_id is None:
+            raise RowError("Unknown employee")
+
+        leave_type_id = self.leave_types.get(str(row.get("leave_type", "")))
+        if leave_type_id is None:
+            raise RowError("Unknown leave type")
+
+        try:
+            start_date = date.fromisoformat(str(row.get("start_date")))
+            end_date = date.fromisoformat(str(row.get("end_date")))
+        except ValueError:
+            raise RowError("Invalid date, use YYYY-MM-DD")
+        if end_date <= start_date:
+            raise RowError("End date cannot be earlier than start date")
+
+        status = row.get("status") or StatusRequestChoices.APPROVED
+        if status not in StatusRequestChoices.values:
+            raise RowError("Unknown status")
+
+        expired = str(row.get("expired", "")).lower() in ("1", "true", "yes")
+
+        return LeaveRequest(
+            employee_id=employee_id,
+            leave_type_id=leave_type_id,
+            start_date=start_date,
+            end_date=end_date,
+            number_of_days=(end_date - start_date).days,
+            comment=row.get("comment") or None,
+            status=status,
+            expired=expired,
+        )
+
+    def _load_periods(self, employee_ids: set[int]) -> None:
+        """Load the stored periods of the employees seen for the first time."""
+        new_ids = employee_ids - self.periods.keys()
+        if not new_ids:
+            return
+
+        for employee_id in new_ids:
+            self.periods[employee_id] = []
+        for employee_id, start_date, end_date in LeaveRequest.objects.filter(
+            employee_id__in=new_ids
+        ).values_list("employee_id", "start_date", "end_date"):
+            self.periods[employee_id].append((start_date, end_date))
+
+    def _import_chunk(self, chunk) -> tuple[int, list[tuple]]:
+        """Validate and insert one chunk, return the count and the errors."""
+        errors = []
+        candidates = {}  # employee_id -> [(start, end, line, row, request)]
+
+        for line_number, row in chunk:
+            try:
+                leave_request = self._parse_row(row)
+            except RowError as e:
+                errors.append((line_number, str(e), json.dumps(row)))
+                continue
+            candidates.setdefault(leave_request.employee_id, []).append(
+                (
+                    leave_request.start_date,
+                    leave_request.end_date,
+                    line_number,
+                    row,
+                    leave_request,
+                )
+            )
+
+        self._load_periods(set(candidates))
+
+        accepted = []
+        for employee_id, employee_candidates in candidates.items():
+            periods = self.periods[employee_id]
+            rejected = sweep_overlaps(periods, employee_candidates)
+            for index, candidate in enumerate(employee_candidates):
+                start_date, end_date, line_number, row, leave_request = (
+                    candidate
+                )
+                if index in rejected:
+                    errors.append(
+                        (
+                            line_number,
+                            "Overlaps another leave request",
+                            json.dumps(row),
+                        )
+                    )
+                else:
+                    periods.append((start_date, end_date))
+                    accepted.append(leave_request)
+
+        with transaction.atomic():
+            bulk_create_with_history(
+                accepted,
+                LeaveRequest,
+                default_change_reason="Imported",
+            )
+
+        errors.sort()
+        return len(accepted), errors
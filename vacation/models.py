@@ -1,37 +1,75 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from simple_history.models import HistoricalRecords
 
-from common.enums import StatusRequestChoices
+from common.enums import (
+    OutboxStatusChoices,
+    RolloverStageChoices,
+    StatusRequestChoices,
+)
 from common.models import BaseModel
 from staff.models import Employee
-from vacation.tasks import send_vacation_request_for_approval
+from vacation.leave_types import LeaveTypeTree, get_leave_type_tree
+from vacation.tasks import dispatch_notification_outbox
 
 
-class VacationUsed(BaseModel):
-    """Counting vacation days used."""
+class VacationBalance(BaseModel):
+    """Vacation days used and remaining per employee, year and leave type."""
 
     employee = models.ForeignKey(
         Employee,
         verbose_name=_("Employee"),
-        related_name="vacation_days",
+        related_name="vacation_balances",
         on_delete=models.CASCADE,
     )
-    days = models.PositiveSmallIntegerField(
+    year = models.PositiveSmallIntegerField(verbose_name=_("Year"))
+    leave_type = models.ForeignKey(
+        "LeaveType",
+        verbose_name=_("Leave Type"),
+        related_name="balances",
+        on_delete=models.CASCADE,
+    )
+    allowance_days = models.PositiveSmallIntegerField(
+        verbose_name=_("Days allowed"),
+        blank=True,
+        null=True,
+        help_text=_("Empty if the leave type has no yearly limit."),
+    )
+    used_days = models.PositiveSmallIntegerField(
         verbose_name=_("Days used"),
         default=0,
     )
+    remaining_days = models.SmallIntegerField(
+        verbose_name=_("Days remaining"),
+        blank=True,
+        null=True,
+    )
+
+    @property
+    def key(self) -> tuple[int, int, int]:
+        """The (employee_id, year, leave_type_id) key of the balance."""
+        return self.employee_id, self.year, self.leave_type_id
 
     def __str__(self):
         return (
-            f"{self.employee.first_name} {self.employee.last_name}: "
-            f"{self.days} {_('days')}"
+            f"{self.employee.first_name} {self.employee.last_name} "
+            f"{self.year} {self.leave_type}: {self.used_days} {_('days')}"
         )
 
     class Meta:
-        ordering = ("days",)
-        verbose_name = _("Vacation used by day")
-        verbose_name_plural = _("Vacation used by days")
+        ordering = ("-year", "employee", "leave_type")
+        verbose_name = _("Vacation balance")
+        verbose_name_plural = _("Vacation balances")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["employee", "year", "leave_type"],
+                name="vacation_balance_unique",
+            ),
+        ]
 
 
 class LeaveRequest(BaseModel):
@@ -70,12 +108,95 @@ class LeaveRequest(BaseModel):
         verbose_name=_("Expired"),
         default=False,
         help_text=_(
-            "If 'True', these days are not counted as vacation days used.<br>"
+            "If 'True', the request belongs to a closed vacation year.<br>"
             "It is set automatically by the system at the appointed time."
         ),
     )
+    idempotency_key = models.CharField(
+        verbose_name=_("Idempotency key"),
+        max_length=64,
+        blank=True,
+        null=True,
+        editable=False,
+        help_text=_("Key of the client request that created it, if any."),
+    )
     history = HistoricalRecords()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_vacation_state()
+        return instance
+
+    @property
+    def counted_days(self) -> int:
+        """Number of days counted as used vacation days."""
+        if self.status == StatusRequestChoices.APPROVED:
+            return self.number_of_days
+        return 0
+
+    @property
+    def balance_key(self) -> tuple[int, int, int]:
+        """The (employee_id, year, leave_type_id) key of its balance."""
+        return self.employee_id, self.start_date.year, self.leave_type_id
+
+    def remember_vacation_state(self):
+        """
+        Remember the stored balance key and counted days so that the next save
+        can apply only the difference to the vacation balances.
+        """
+        deferred_fields = self.get_deferred_fields()
+        if any(
+            field in deferred_fields
+            for field in (
+                "employee_id",
+                "leave_type_id",
+                "start_date",
+                "status",
+                "number_of_days",
+            )
+        ):
+            self._vacation_state = None
+        else:
+            self._vacation_state = (self.balance_key, self.counted_days)
+
+    def load_vacation_state(self):
+        """
+        Remember the balance key and counted days of the stored row, which
+        stays locked until the end of the transaction. The state remembered
+        when the instance was loaded may be stale if the row was changed
+        through another instance since then.
+        """
+        stored = (
+            LeaveRequest.objects.select_for_update()
+            .filter(pk=self.pk)
+            .values_list(
+                "employee_id",
+                "start_date",
+                "leave_type_id",
+                "status",
+                "number_of_days",
+            )
+            .first()
+            if self.pk is not None
+            else None
+        )
+        if stored is None:
+            self._vacation_state = None
+            return
+        employee_id, start_date, leave_type_id, status, number_of_days = stored
+        self._vacation_state = (
+            (employee_id, start_date.year, leave_type_id),
+            (number_of_days if status == StatusRequestChoices.APPROVED else 0),
+        )
+
+    def get_vacation_state(self) -> tuple[tuple[int, int, int], int] | None:
+        """
+        Return the (balance_key, counted_days) pair remembered before the
+        last change, or None if it is unknown.
+        """
+        return getattr(self, "_vacation_state", None)
+
     def calculate_number_of_days(self):
         """Calculates the number of days."""
         self.number_of_days = (self.end_date - self.start_date).days
@@ -83,6 +204,19 @@ class LeaveRequest(BaseModel):
     def submit_for_approval(self):
         """Submit the leave request for approval."""
 
+        # Update the status to pending and queue the approval message in the
+        # same transaction, so that nothing is sent if it is rolled back
+        with transaction.atomic():
+            self.status = StatusRequestChoices.PENDING
+            self.save()
+            self.queue_approval_message()
+
+    def queue_approval_message(self):
+        """
+        Queue the approval message to the managers, to be sent when the
+        current transaction commits.
+        """
+
         # Format the approval message
         msg = _(
             f"<b>Approval request #{self.pk}:</b>\n{self.employee}\n"
@@ -91,18 +225,29 @@ class LeaveRequest(BaseModel):
             f"{self.leave_type}\n"
             f"<i>{self.comment if self.comment else ''}</i>"
         )
+        NotificationOutbox.objects.create(leave_request=self, text=msg)
 
-        # Update the status to pending
-        self.status = StatusRequestChoices.PENDING
-        self.save()
+        # [celery] Sends the queued messages to managers in Telegram. The
+        # notification is committed already, if the broker is down the
+        # periodic dispatch delivers it
+        transaction.on_commit(dispatch_notification_outbox.delay, robust=True)
 
-        # [celery] Sends a message to managers requesting approval in Telegram
-        send_vacation_request_for_approval.delay(text=msg)
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self.remember_vacation_state()
 
     def save(self, *args, **kwargs):
         """Overrides the save method."""
         self.calculate_number_of_days()
-        super().save(*args, **kwargs)
+        # The balances change by the difference with the stored row
+        with transaction.atomic(savepoint=False):
+            self.load_vacation_state()
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(savepoint=False):
+            self.load_vacation_state()
+            return super().delete(*args, **kwargs)
 
     def __str__(self):
         return f"#{self.pk} {self.leave_type}: {self.employee} ({self.number_of_days} day's)"
@@ -110,6 +255,22 @@ class LeaveRequest(BaseModel):
     class Meta:
         verbose_name = _("Leave Request")
         verbose_name_plural = _("Leave Requests")
+        indexes = [
+            models.Index(
+                fields=["employee", "start_date", "end_date"],
+                name="leave_request_period_idx",
+            ),
+            models.Index(
+                fields=["employee", "updated_at"],
+                name="leave_request_updated_idx",
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["employee", "idempotency_key"],
+                name="leave_request_idempotency_key_unique",
+            ),
+        ]
 
 
 class LeaveType(BaseModel):
@@ -124,17 +285,180 @@ class LeaveType(BaseModel):
         null=True,
         blank=True,
     )
+    days_per_year = models.PositiveSmallIntegerField(
+        verbose_name=_("Days per year"),
+        blank=True,
+        null=True,
+        help_text=_("Yearly allowance, empty if there is no limit."),
+    )
+    path = models.CharField(
+        verbose_name=_("Path"),
+        max_length=255,
+        db_index=True,
+        editable=False,
+        default="",
+        help_text=_("Ids from the root down to the type, e.g. '1/4/'."),
+    )
+    depth = models.PositiveSmallIntegerField(
+        verbose_name=_("Depth"),
+        editable=False,
+        default=0,
+    )
 
     class Meta:
         verbose_name = _("Leave type")
         verbose_name_plural = _("Leave types")
 
     def __str__(self):
-        return (
-            str(self.title)
-            if self.parent is None
-            else f"{self.parent} - {self.title}"
+        if self.parent_id is None:
+            return str(self.title)
+
+        tree = get_leave_type_tree()
+        if self.parent_id in tree:
+            return f"{tree.full_title(self.parent_id)} - {self.title}"
+        return f"{self.parent} - {self.title}"
+
+    def clean(self):
+        super().clean()
+        if (
+            self.pk
+            and self.parent_id
+            and self.pk in get_leave_type_tree().ancestors(self.parent_id)
+        ):
+            raise ValidationError(
+                {"parent": _("A leave type cannot be nested in itself.")}
+            )
+
+    def save(self, *args, **kwargs):
+        """Save the leave type and keep the paths of its subtree up to date."""
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.update_path()
+
+    def update_path(self):
+        """Recalculate the path and the depth, moving the subtree with it."""
+        if self.parent_id is None:
+            path, depth = f"{self.pk}/", 0
+        else:
+            parent_path, parent_depth = LeaveType.objects.values_list(
+                "path", "depth"
+            ).get(pk=self.parent_id)
+            path, depth = f"{parent_path}{self.pk}/", parent_depth + 1
+        if (path, depth) == (self.path, self.depth):
+            return
+
+        if self.path:
+            LeaveType.objects.filter(path__startswith=self.path).exclude(
+                pk=self.pk
+            ).update(
+                path=Concat(Value(path), Substr("path", len(self.path) + 1)),
+                depth=F("depth") + depth - self.depth,
+            )
+        LeaveType.objects.filter(pk=self.pk).update(path=path, depth=depth)
+        self.path, self.depth = path, depth
+
+    @classmethod
+    def rebuild_paths(cls):
+        """Recalculate the paths of every leave type from the parents."""
+        tree = LeaveTypeTree(
+            cls.objects.values_list("pk", "title", "parent_id")
         )
+        leave_types = list(cls.objects.all())
+        for leave_type in leave_types:
+            ancestors = tree.ancestors(leave_type.pk)
+            leave_type.path = "".join(f"{pk}/" for pk in ancestors)
+            leave_type.depth = len(ancestors) - 1
+        cls.objects.bulk_update(leave_types, ["path", "depth"])
 
     def get_subtype(self):
         return self.subtypes.all()
+
+
+class RolloverCheckpoint(BaseModel):
+    """Progress of the year-end rollover, used to resume an interrupted run."""
+
+    year = models.PositiveSmallIntegerField(
+        verbose_name=_("Year"),
+        unique=True,
+    )
+    stage = models.CharField(
+        verbose_name=_("Stage"),
+        max_length=10,
+        choices=RolloverStageChoices.choices,
+        default=RolloverStageChoices.BALANCES,
+    )
+    last_pk = models.BigIntegerField(
+        verbose_name=_("Last processed id"),
+        default=0,
+        help_text=_("Primary key of the last row processed in the stage."),
+    )
+    processed = models.PositiveIntegerField(
+        verbose_name=_("Rows processed"),
+        default=0,
+    )
+    finished_at = models.DateTimeField(
+        verbose_name=_("Finished at"),
+        blank=True,
+        null=True,
+    )
+
+    def __str__(self):
+        return f"{self.year}: {self.get_stage_display()}"
+
+    class Meta:
+        ordering = ("-year",)
+        verbose_name = _("Rollover checkpoint")
+        verbose_name_plural = _("Rollover checkpoints")
+
+
+class NotificationOutbox(BaseModel):
+    """Notification to managers waiting to be delivered in Telegram."""
+
+    leave_request = models.ForeignKey(
+        LeaveRequest,
+        verbose_name=_("Leave Request"),
+        related_name="notifications",
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+    )
+    text = models.TextField(verbose_name=_("Text"))
+    status = models.CharField(
+        verbose_name=_("Status"),
+        max_length=20,
+        default=OutboxStatusChoices.PENDING,
+        choices=OutboxStatusChoices.choices,
+    )
+    attempts = models.PositiveSmallIntegerField(
+        verbose_name=_("Attempts"),
+        default=0,
+    )
+    next_attempt_at = models.DateTimeField(
+        verbose_name=_("Next attempt"),
+        default=timezone.now,
+    )
+    delivered_to = models.JSONField(
+        verbose_name=_("Delivered to"),
+        default=list,
+        blank=True,
+        help_text=_("Telegram ids that already received the notification."),
+    )
+    last_error = models.TextField(
+        verbose_name=_("Last error"),
+        blank=True,
+        null=True,
+    )
+
+    def __str__(self):
+        return f"#{self.pk} {self.get_status_display()} ({self.attempts})"
+
+    class Meta:
+        ordering = ("pk",)
+        verbose_name = _("Notification outbox")
+        verbose_name_plural = _("Notification outbox")
+        indexes = [
+            models.Index(
+                fields=["status", "next_attempt_at"],
+                name="outbox_status_next_idx",
+            ),
+        ]
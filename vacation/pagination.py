@@ -0,0 +1,13 @@
+from rest_framework.pagination import CursorPagination
+
+
+class LeaveRequestCursorPagination(CursorPagination):
+    """
+    Keyset pagination of leave requests on (start_date, id).
+    Every page costs the same however long the history is.
+    """
+
+    ordering = ("start_date", "id")
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
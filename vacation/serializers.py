@@ -3,7 +3,10 @@ from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 
 from common.enums import StatusRequestChoices
-from vacation.models import LeaveRequest, VacationUsed, LeaveType
+from common.serializers import SparseFieldsetsMixin
+from vacation.leave_types import get_leave_type_tree
+from vacation.models import LeaveRequest, VacationBalance, LeaveType
+from vacation.services import find_overlapping_requests
 
 
 class VacationLeaveTypeSerializer(serializers.ModelSerializer):
@@ -12,8 +15,11 @@ class VacationLeaveTypeSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def get_title(obj):
+        tree = get_leave_type_tree()
         represent = (
-            obj.title if obj.parent is None else f"{obj.parent} ({obj.title})"
+            obj.title
+            if obj.parent_id is None or obj.parent_id not in tree
+            else f"{tree.full_title(obj.parent_id)} ({obj.title})"
         )
         return str(represent)
 
@@ -22,7 +28,9 @@ class VacationLeaveTypeSerializer(serializers.ModelSerializer):
         fields = ("id", "title")
 
 
-class LeaveRequestUserSerializer(serializers.ModelSerializer):
+class LeaveRequestUserSerializer(
+    SparseFieldsetsMixin, serializers.ModelSerializer
+):
     """Leave request serializer class"""
 
     expired = serializers.BooleanField(default=False, read_only=True)
@@ -38,30 +46,29 @@ class LeaveRequestUserSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = LeaveRequest
-        exclude = ("created_at", "updated_at")
+        exclude = ("created_at", "updated_at", "idempotency_key")
 
     def validate(self, data):
-        request = self.context.get("request")
-        employee = request.user
+        employee = self.context.get("employee")
+        if employee is None:
+            request = self.context.get("request")
+            if request is not None and request.user.is_authenticated:
+                employee = request.user
 
         start_date = data.get("start_date")
         end_date = data.get("end_date")
 
         # Check for overlapping leave requests for the employee
-        if start_date and end_date and employee.is_authenticated:
-            overlapping_requests = LeaveRequest.objects.filter(
-                employee=employee,
-                start_date__lte=end_date,
-                end_date__gte=start_date,
-            )
-
+        if start_date and end_date and employee is not None:
             # If we are updating an instance, exclude the current instance from the check
-            if self.instance and self.instance.pk:
-                overlapping_requests = overlapping_requests.exclude(
-                    pk=self.instance.pk
-                )
+            overlapping_requests = find_overlapping_requests(
+                employee.pk,
+                start_date,
+                end_date,
+                exclude_pk=self.instance.pk if self.instance else None,
+            )
 
-            if overlapping_requests.exists():
+            if overlapping_requests:
                 overlapping_dates = ", ".join(
                     f"{req.start_date} - {req.end_date}"
                     for req in overlapping_requests
@@ -75,7 +82,55 @@ class LeaveRequestUserSerializer(serializers.ModelSerializer):
         return data
 
 
-class VacationUsedSerializer(serializers.ModelSerializer):
+class LeaveRequestSubmitSerializer(LeaveRequestUserSerializer):
+    """Leave request created already submitted for approval."""
+
+    idempotency_key = serializers.CharField(
+        write_only=True, required=False, allow_blank=True, max_length=64
+    )
+
+    class Meta(LeaveRequestUserSerializer.Meta):
+        exclude = ("created_at", "updated_at")
+
+
+class TeamAvailabilityQuerySerializer(serializers.Serializer):
+    """Query parameters of the team availability endpoint."""
+
+    MAX_DAYS = 731
+
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+
+    def validate(self, data):
+        days = (data["end_date"] - data["start_date"]).days + 1
+        if days < 1:
+            raise serializers.ValidationError(
+                _("Start date cannot be later than end date.")
+            )
+        if days > self.MAX_DAYS:
+            raise serializers.ValidationError(
+                _("The period cannot be longer than %(days)s days.")
+                % {"days": self.MAX_DAYS}
+            )
+        return data
+
+
+class TeamCapacityQuerySerializer(TeamAvailabilityQuerySerializer):
+    """Query parameters of the team capacity report."""
+
+    job_title = serializers.CharField(required=False)
+    threshold = serializers.FloatField(
+        required=False, min_value=0, max_value=1
+    )
+
+
+class LeaveRequestChangesQuerySerializer(serializers.Serializer):
+    """Query parameters of the leave request delta sync."""
+
+    since = serializers.DateTimeField(required=False)
+
+
+class VacationBalanceSerializer(serializers.ModelSerializer):
     class Meta:
-        model = VacationUsed
+        model = VacationBalance
         fields = "__all__"
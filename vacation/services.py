@@ -0,0 +1,838 @@
+from datetime import date, timedelta
+from typing import Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractYear
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ValidationError
+
+from common.cache import (
+    bump_namespace_version,
+    get_namespace_version,
+    get_or_set_single_flight,
+)
+from common.enums import StatusRequestChoices
+from common.logger import logger
+from staff.models import DutyRoster, Employee
+from vacation.leave_types import get_leave_type_tree
+from vacation.models import LeaveRequest, LeaveType, VacationBalance
+
+ORG_DASHBOARD_NAMESPACE = "dashboard:org"
+USER_DASHBOARD_NAMESPACE = "dashboard:user"
+DASHBOARD_CACHE_TIMEOUT = 60 * 60 * 24
+AVAILABILITY_NAMESPACE = "availability"
+AVAILABILITY_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+
+class QueryCounter:
+    """Context manager counting the queries run on the default connection."""
+
+    def __init__(self):
+        self.count = 0
+        self._wrapper = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._wrapper.__exit__(exc_type, exc_value, traceback)
+
+
+def recompute_vacation_balances(employee_ids: Iterable[int]) -> None:
+    """
+    Recalculate every vacation balance of the employees from scratch with
+    one grouped aggregate.
+    """
+    employee_ids = set(employee_ids)
+    if not employee_ids:
+        return
+
+    totals = {
+        (row["employee_id"], row["year"], row["leave_type_id"]): row["total"]
+        for row in LeaveRequest.objects.filter(
+            employee_id__in=employee_ids,
+            status=StatusRequestChoices.APPROVED,
+        )
+        .annotate(year=ExtractYear("start_date"))
+        .values("employee_id", "year", "leave_type_id")
+        .annotate(total=Sum("number_of_days"))
+        .order_by()
+    }
+    allowances = dict(LeaveType.objects.values_list("pk", "days_per_year"))
+
+    now = timezone.now()
+    with transaction.atomic():
+        balances = list(
+            VacationBalance.objects.filter(employee_id__in=employee_ids)
+        )
+        for balance in balances:
+            balance.used_days = totals.get(balance.key, 0)
+            balance.remaining_days = _remaining_days(
+                balance.allowance_days, balance.used_days
+            )
+            balance.updated_at = now
+        VacationBalance.objects.bulk_update(
+            balances, ["used_days", "remaining_days", "updated_at"]
+        )
+
+        existing_keys = {balance.key for balance in balances}
+        VacationBalance.objects.bulk_create(
+            VacationBalance(
+                employee_id=employee_id,
+                year=year,
+                leave_type_id=leave_type_id,
+                allowance_days=allowances.get(leave_type_id),
+                used_days=used_days,
+                remaining_days=_remaining_days(
+                    allowances.get(leave_type_id), used_days
+                ),
+            )
+            for (employee_id, year, leave_type_id), used_days in totals.items()
+            if (employee_id, year, leave_type_id) not in existing_keys
+        )
+
+
+def _remaining_days(allowance_days: int | None, used_days: int) -> int | None:
+    return None if allowance_days is None else allowance_days - used_days
+
+
+def apply_vacation_balance_delta(
+    key: tuple[int, int, int], delta: int
+) -> None:
+    """
+    Add the delta to the used days of the (employee_id, year, leave_type_id)
+    balance with an atomic UPDATE. Falls back to a full recalculation of the
+    employee if the balance does not exist yet or would drop below zero.
+    """
+    if not delta:
+        return
+
+    employee_id, year, leave_type_id = key
+    updated = VacationBalance.objects.filter(
+        employee_id=employee_id,
+        year=year,
+        leave_type_id=leave_type_id,
+        used_days__gte=max(-delta, 0),
+    ).update(
+        used_days=F("used_days") + delta,
+        remaining_days=F("remaining_days") - delta,
+        updated_at=timezone.now(),
+    )
+    if not updated:
+        recompute_vacation_balances([employee_id])
+
+
+class VacationBalanceBatch:
+    """
+    Changes of the vacation balances collected during one transaction.
+    The batch is applied once the transaction is committed: a change of a
+    single balance with a known delta is applied as an F() update, anything
+    else is recalculated for the affected employees with one grouped
+    aggregate. Nothing is applied if the transaction is rolled back.
+    """
+
+    def __init__(self):
+        # balance key -> accumulated delta, None if it has to be recalculated
+        self.deltas: dict[tuple[int, int, int], int | None] = {}
+
+    def add(self, key: tuple[int, int, int], delta: int | None) -> None:
+        """Add the change of the used days of the balance."""
+        current = self.deltas.get(key, 0)
+        self.deltas[key] = (
+            None if current is None or delta is None else current + delta
+        )
+
+    def __call__(self) -> None:
+        if len(self.deltas) == 1:
+            ((key, delta),) = self.deltas.items()
+            if delta is not None:
+                apply_vacation_balance_delta(key, delta)
+                return
+        recompute_vacation_balances(key[0] for key in self.deltas)
+
+
+def _get_vacation_balance_batch() -> VacationBalanceBatch:
+    """Return the batch of the current transaction, registering it if needed."""
+    db_connection = transaction.get_connection()
+    batch = getattr(db_connection, "vacation_balance_batch", None)
+
+    # The batch is stale once its on_commit callback ran or was discarded
+    # by a rollback, in both cases it is no longer in the callback list.
+    if batch is None or not any(
+        func is batch for _sids, func, _robust in db_connection.run_on_commit
+    ):
+        batch = VacationBalanceBatch()
+        db_connection.vacation_balance_batch = batch
+        transaction.on_commit(batch)
+    return batch
+
+
+def update_vacation_balance(
+    leave_request: LeaveRequest, created=False, deleted=False
+) -> None:
+    """
+    Register the change of the leave request to the vacation balances.
+    The state remembered before the change is compared with the current one
+    and only the difference is recorded. Inside a transaction the changes
+    are collected and applied on commit, otherwise they are applied at once.
+    """
+    if created:
+        # A new record did not count towards the used vacation days before
+        previous_state = (leave_request.balance_key, 0)
+    else:
+        previous_state = leave_request.get_vacation_state()
+
+    db_connection = transaction.get_connection()
+    if db_connection.in_atomic_block:
+        batch = _get_vacation_balance_batch()
+    else:
+        batch = VacationBalanceBatch()
+
+    # Deltas recorded inside a savepoint may be rolled back on their own,
+    # so those balances are recalculated instead.
+    known = previous_state is not None and not db_connection.savepoint_ids
+    current_days = 0 if deleted else leave_request.counted_days
+    if not known:
+        batch.add(leave_request.balance_key, None)
+        if previous_state is not None:
+            batch.add(previous_state[0], None)
+    elif previous_state[0] != leave_request.balance_key:
+        batch.add(previous_state[0], -previous_state[1])
+        batch.add(leave_request.balance_key, current_days)
+    else:
+        batch.add(leave_request.balance_key, current_days - previous_state[1])
+
+    if not db_connection.in_atomic_block:
+        batch()
+    leave_request.remember_vacation_state()
+
+
+def get_used_vacation_days(employee, year: int) -> int:
+    """
+    Return the vacation days the employee used in the year with a single
+    lookup on the (employee, year) balance index.
+    """
+    return (
+        VacationBalance.objects.filter(employee=employee, year=year).aggregate(
+            total=Sum("used_days")
+        )["total"]
+        or 0
+    )
+
+
+def open_vacation_year(year: int, employee_ids: Iterable[int]) -> None:
+    """
+    Open the balances of the year for the employees and every leave type
+    with a yearly allowance. Existing balances are left untouched.
+    """
+    leave_types = list(
+        LeaveType.objects.filter(days_per_year__isnull=False).values_list(
+            "pk", "days_per_year"
+        )
+    )
+    VacationBalance.objects.bulk_create(
+        (
+            VacationBalance(
+                employee_id=employee_id,
+                year=year,
+                leave_type_id=leave_type_id,
+                allowance_days=days_per_year,
+                remaining_days=days_per_year,
+            )
+            for employee_id in employee_ids
+            for leave_type_id, days_per_year in leave_types
+        ),
+        ignore_conflicts=True,
+    )
+
+
+def refresh_vacation_allowance(leave_type: LeaveType) -> None:
+    """
+    Apply the yearly allowance of the leave type to the balances of the
+    current and the following years. Closed years keep their allowance.
+    """
+    balances = VacationBalance.objects.filter(
+        leave_type=leave_type, year__gte=timezone.localdate().year
+    )
+    if leave_type.days_per_year is None:
+        balances.update(
+            allowance_days=None,
+            remaining_days=None,
+            updated_at=timezone.now(),
+        )
+    else:
+        balances.update(
+            allowance_days=leave_type.days_per_year,
+            remaining_days=leave_type.days_per_year - F("used_days"),
+            updated_at=timezone.now(),
+        )
+
+
+def find_overlapping_requests(
+    employee, start_date: date, end_date: date, exclude_pk: int | None = None
+) -> list[LeaveRequest]:
+    """
+    Return the leave requests of the employee that overlap the given period.
+    Like LeaveRequest.number_of_days, the end dates are the days the employee
+    is back: a request ending on the start date of the period does not
+    overlap it. The lookup is served by the (employee, start_date, end_date)
+    index and runs a single query.
+    """
+    overlapping_requests = LeaveRequest.objects.filter(
+        employee=employee,
+        start_date__lt=end_date,
+        end_date__gt=start_date,
+    ).order_by("start_date", "pk")
+    if exclude_pk is not None:
+        overlapping_requests = overlapping_requests.exclude(pk=exclude_pk)
+    return list(overlapping_requests)
+
+
+def describe_overlapping_requests(
+    employee, start_date: date, end_date: date
+) -> dict:
+    """
+    Return whether the period overlaps leave requests of the employee and
+    the overlapping periods, one per line, for the bot.
+    """
+    overlapping_requests = find_overlapping_requests(
+        employee, start_date, end_date
+    )
+    return {
+        "overlap": bool(overlapping_requests),
+        "leave_request": (
+            ",\n".join(
+                f"#{req.pk}: {req.start_date} - {req.end_date}"
+                for req in overlapping_requests
+            )
+            if overlapping_requests
+            else None
+        ),
+    }
+
+
+def validate_leave_request_period(
+    start_date: date, end_date: date
+) -> str | None:
+    """Return why a new leave request cannot cover the period, if it cannot."""
+    if start_date < timezone.now().date():
+        return _("Start date cannot be earlier than the current date.")
+    if start_date >= end_date:
+        return _("Start date cannot be later than or equal to end date.")
+    return None
+
+
+def get_user_leave_requests(employee_id: int):
+    """Return the current (not expired) leave requests of the employee."""
+    return LeaveRequest.objects.filter(
+        employee_id=employee_id, expired=False
+    ).select_related("employee", "leave_type__parent")
+
+
+def get_requestable_leave_types():
+    """
+    Return the leave types that can be requested, the ones without subtypes.
+    They are taken from the cached leave type tree.
+    """
+    return LeaveType.objects.filter(
+        pk__in=get_leave_type_tree().leaf_ids
+    ).order_by("path")
+
+
+def is_telegram_employee(telegram_id) -> bool:
+    """Return True if an employee has the given telegram id."""
+    return Employee.objects.filter(telegram_id=telegram_id).exists()
+
+
+def submit_leave_request(leave_request: LeaveRequest) -> None:
+    """Submit the leave request for approval."""
+    leave_request.submit_for_approval()
+
+
+def get_leave_request_by_idempotency_key(
+    employee_id: int, idempotency_key: str | None
+) -> LeaveRequest | None:
+    """Return the leave request created by the client request, if any."""
+    if not idempotency_key:
+        return None
+    return LeaveRequest.objects.filter(
+        employee_id=employee_id, idempotency_key=idempotency_key
+    ).first()
+
+
+def create_submitted_leave_request(
+    employee_id: int, data: dict, idempotency_key: str | None = None
+) -> tuple[LeaveRequest, bool]:
+    """
+    Create a leave request already submitted for approval: a single save in
+    the PENDING status (one history row) and the approval message queued in
+    the same transaction. A repeated idempotency key returns the leave
+    request created the first time instead, even for concurrent requests.
+    Returns the leave request and whether it was created.
+    """
+    leave_request = LeaveRequest(
+        **{
+            **data,
+            "employee_id": employee_id,
+            "status": StatusRequestChoices.PENDING,
+            "idempotency_key": idempotency_key or None,
+        }
+    )
+    try:
+        with transaction.atomic():
+            leave_request.save()
+            leave_request.queue_approval_message()
+    except IntegrityError:
+        existing = get_leave_request_by_idempotency_key(
+            employee_id, idempotency_key
+        )
+        if existing is None:
+            raise
+        return existing, False
+    return leave_request, True
+
+
+def create_leave_request(
+    serializer, employee_id: int, submit: bool = False
+) -> tuple[LeaveRequest, bool]:
+    """
+    Validate the leave request data bound to the serializer and create the
+    leave request of the employee, already submitted for approval with
+    `submit`. A submitted request repeating the idempotency key of an
+    earlier one returns the leave request created then. Returns the leave
+    request and whether it was created, raises ValidationError.
+    """
+    if submit:
+        # Replays are answered before the validation, which they would fail
+        existing = get_leave_request_by_idempotency_key(
+            employee_id, serializer.initial_data.get("idempotency_key")
+        )
+        if existing is not None:
+            return existing, False
+
+    serializer.is_valid(raise_exception=True)
+    data = dict(serializer.validated_data)
+    error = validate_leave_request_period(data["start_date"], data["end_date"])
+    if error:
+        raise ValidationError({"status": error})
+
+    if not submit:
+        return serializer.save(employee_id=employee_id), True
+    idempotency_key = data.pop("idempotency_key", None)
+    return create_submitted_leave_request(employee_id, data, idempotency_key)
+
+
+def _user_dashboard_namespace(employee_id: int) -> str:
+    return f"{USER_DASHBOARD_NAMESPACE}:{employee_id}"
+
+
+def _build_org_dashboard_panels(today: date) -> dict:
+    """Build the panels that are the same for the whole company."""
+
+    # Currently on vacation
+    currently_on_leave = list(
+        LeaveRequest.objects.filter(
+            start_date__lte=today,
+            end_date__gte=today,
+            status=StatusRequestChoices.APPROVED,
+        ).select_related("employee", "leave_type__parent")
+    )
+
+    # Current duty, the weekends are planned several weeks ahead
+    duty_now = (
+        DutyRoster.objects.filter(end_date__gte=today)
+        .select_related("employee")
+        .order_by("start_date")
+        .first()
+    )
+
+    return {"currently_on_leave": currently_on_leave, "duty_now": duty_now}
+
+
+def _build_user_dashboard_panels(employee: Employee, today: date) -> dict:
+    """
+    Build the panels that belong to a single employee.
+    The approved leave requests of the employee are fetched in one query and
+    the periods are derived from that result set, the used days are read
+    from the balances of the current year with one more indexed lookup.
+    """
+    with QueryCounter() as counter:
+        approved_requests = list(
+            LeaveRequest.objects.filter(
+                employee=employee,
+                status=StatusRequestChoices.APPROVED,
+            )
+            .select_related("leave_type__parent")
+            .order_by("start_date", "pk")
+        )
+        balances = list(
+            VacationBalance.objects.filter(
+                employee=employee, year=today.year, used_days__gt=0
+            )
+            .select_related("leave_type__parent")
+            .order_by("leave_type")
+        )
+
+    upcoming_leaves = []
+    current_user_on_leave = None
+    user_last_vacation = None
+
+    for leave in approved_requests:
+        # Upcoming Leave
+        if leave.start_date > today:
+            upcoming_leaves.append(leave)
+
+        # Current user on leave
+        if leave.start_date <= today <= leave.end_date and (
+            current_user_on_leave is None
+            or leave.pk > current_user_on_leave.pk
+        ):
+            current_user_on_leave = leave
+
+        # User's last vacation
+        if leave.end_date <= today and (
+            user_last_vacation is None
+            or leave.end_date > user_last_vacation.end_date
+        ):
+            user_last_vacation = leave
+
+    # The number of days used for each type of vacation this year
+    leave_type_days_summary = []
+    for balance in balances:
+        leave_type = balance.leave_type
+        parent_title = leave_type.parent.title if leave_type.parent else None
+        leave_type_days_summary.append(
+            {
+                "leave_type__title": leave_type.title,
+                "leave_type__parent__title": parent_title,
+                "leave_type__pk": leave_type.pk,
+                "pk": leave_type.pk,
+                "total_days": balance.used_days,
+                "full_title": (
+                    f"{parent_title} - {leave_type.title}"
+                    if parent_title
+                    else leave_type.title
+                ),
+            }
+        )
+    vacation_days_used = sum(balance.used_days for balance in balances)
+
+    logger.debug(
+        "Dashboard panels of %s built with %s queries",
+        employee,
+        counter.count,
+    )
+    return {
+        "upcoming_leaves": upcoming_leaves,
+        "current_user_on_leave": current_user_on_leave,
+        "user_last_vacation": user_last_vacation,
+        "leave_type_days_summary": leave_type_days_summary,
+        "vacation_days_used": vacation_days_used,
+        "dashboard_query_count": counter.count,
+    }
+
+
+def get_org_dashboard_panels(today: date) -> dict:
+    """
+    Return the company-wide dashboard panels.
+    They are cached once per day and per version of the org namespace.
+    """
+    version = get_namespace_version(ORG_DASHBOARD_NAMESPACE)
+    key = f"{ORG_DASHBOARD_NAMESPACE}:{today.isoformat()}:v{version}"
+    return get_or_set_single_flight(
+        key,
+        lambda: _build_org_dashboard_panels(today),
+        timeout=DASHBOARD_CACHE_TIMEOUT,
+    )
+
+
+def get_user_dashboard_panels(employee: Employee, today: date) -> dict:
+    """
+    Return the dashboard panels of the employee.
+    They are cached per employee, per day and per version of the employee
+    namespace.
+    """
+    namespace = _user_dashboard_namespace(employee.pk)
+    version = get_namespace_version(namespace)
+    key = f"{namespace}:{today.isoformat()}:v{version}"
+    return get_or_set_single_flight(
+        key,
+        lambda: _build_user_dashboard_panels(employee, today),
+        timeout=DASHBOARD_CACHE_TIMEOUT,
+    )
+
+
+def invalidate_org_dashboard() -> None:
+    """
+    Drop the cached company-wide dashboard panels once the current
+    transaction commits, so that a concurrent reader cannot cache the data
+    from before the commit under the new version.
+    """
+    transaction.on_commit(
+        lambda: bump_namespace_version(ORG_DASHBOARD_NAMESPACE)
+    )
+
+
+def invalidate_user_dashboard(employee_id: int) -> None:
+    """Drop the cached dashboard panels of the employee on commit."""
+    namespace = _user_dashboard_namespace(employee_id)
+    transaction.on_commit(lambda: bump_namespace_version(namespace))
+
+
+def _year_bitset(periods: Iterable[tuple[date, date]], year: int) -> int:
+    """
+    Return the days of the year covered by the periods as a bitset.
+    Bit 0 is January 1st. Like LeaveRequest.number_of_days, a period covers
+    its start date up to the day before its end date: the end date, when the
+    employee is back, is not set.
+    """
+    first_day = date(year, 1, 1)
+    next_year = date(year + 1, 1, 1)
+    bits = 0
+    for start_date, end_date in periods:
+        start_date = max(start_date, first_day)
+        end_date = min(end_date, next_year)
+        if start_date < end_date:
+            length = (end_date - start_date).days
+            bits |= ((1 << length) - 1) << (start_date - first_day).days
+    return bits
+
+
+def _availability_key(version: int, year: int, employee_id: int) -> str:
+    return f"{AVAILABILITY_NAMESPACE}:v{version}:{year}:{employee_id}"
+
+
+def _build_availability(
+    version: int, employee_ids: Iterable[int], years: Iterable[int]
+) -> dict[str, int]:
+    """
+    Build the yearly absence bitsets of the employees with one range query
+    over their approved leave requests and store them in the cache.
+    """
+    employee_ids = set(employee_ids)
+    years = sorted(set(years))
+    if not employee_ids or not years:
+        return {}
+
+    periods = {}
+    for employee_id, start_date, end_date in LeaveRequest.objects.filter(
+        employee_id__in=employee_ids,
+        status=StatusRequestChoices.APPROVED,
+        start_date__lte=date(years[-1], 12, 31),
+        end_date__gt=date(years[0], 1, 1),
+    ).values_list("employee_id", "start_date", "end_date"):
+        periods.setdefault(employee_id, []).append((start_date, end_date))
+
+    bitsets = {
+        _availability_key(version, year, employee_id): _year_bitset(
+            periods.get(employee_id, ()), year
+        )
+        for employee_id in employee_ids
+        for year in years
+    }
+    cache.set_many(bitsets, timeout=AVAILABILITY_CACHE_TIMEOUT)
+    return bitsets
+
+
+def refresh_employee_availability(
+    employee_ids: Iterable[int], years: Iterable[int]
+) -> None:
+    """Rebuild the cached absence bitsets of the employees for the years."""
+    _build_availability(
+        get_namespace_version(AVAILABILITY_NAMESPACE), employee_ids, years
+    )
+
+
+def invalidate_availability() -> None:
+    """Drop every cached absence bitset, e.g. after a bulk import."""
+    bump_namespace_version(AVAILABILITY_NAMESPACE)
+
+
+def get_team_availability(start_date: date, end_date: date) -> dict:
+    """
+    Return the absences of the active employees between the dates, both
+    included. An employee is absent from the start date of a leave request
+    up to the day before its end date, so the absent days of a request add
+    up to its number_of_days.
+    Every absent employee gets a bitmap of the period as a hex string, bit 0
+    is the start date. The daily headcounts hold the number of absent and
+    present employees per day. The answer is built from the cached yearly
+    bitsets, only the bitsets missing from the cache are read from the
+    leave requests.
+    """
+    employees = list(
+        Employee.objects.filter(is_active=True)
+        .order_by("pk")
+        .values_list("pk", "username", "first_name", "last_name")
+    )
+    years = range(start_date.year, end_date.year + 1)
+    version = get_namespace_version(AVAILABILITY_NAMESPACE)
+
+    keys = {
+        (employee[0], year): _availability_key(version, year, employee[0])
+        for employee in employees
+        for year in years
+    }
+    bitsets = cache.get_many(keys.values())
+    missing = {
+        employee_id
+        for (employee_id, _year), key in keys.items()
+        if key not in bitsets
+    }
+    if missing:
+        bitsets.update(_build_availability(version, missing, years))
+
+    days = (end_date - start_date).days + 1
+    absent = [0] * days
+    absences = []
+    for employee_id, username, first_name, last_name in employees:
+        # Cut the period out of every yearly bitset and join the pieces
+        bits = 0
+        for year in years:
+            first_day = max(start_date, date(year, 1, 1))
+            last_day = min(end_date, date(year, 12, 31))
+            offset = (first_day - date(year, 1, 1)).days
+            length = (last_day - first_day).days + 1
+            piece = (bitsets[keys[employee_id, year]] >> offset) & (
+                (1 << length) - 1
+            )
+            bits |= piece << (first_day - start_date).days
+        if not bits:
+            continue
+
+        absences.append(
+            {
+                "id": employee_id,
+                "name": (
+                    f"{first_name} {last_name}"
+                    if first_name and last_name
+                    else username
+                ),
+                "days": bits.bit_count(),
+                "bitmap": format(bits, "x"),
+            }
+        )
+        # Only the set bits are visited, absences are sparse
+        while bits:
+            lowest = bits & -bits
+            absent[lowest.bit_length() - 1] += 1
+            bits ^= lowest
+
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        "employees_count": len(employees),
+        "absent": absent,
+        "present": [len(employees) - count for count in absent],
+        "absences": absences,
+    }
+
+
+def max_concurrent_absences(
+    periods: Iterable[tuple[date, date]],
+) -> tuple[int, date | None]:
+    """
+    Return the maximum number of periods overlapping on one day and the
+    first day it is reached. Like LeaveRequest.number_of_days, a period ends
+    on the day before its end date, the day the employee is back. The start
+    days and the end dates are sorted separately and swept once, so a period
+    ending on the start date of another one does not overlap it.
+    """
+    starts = []
+    ends = []
+    for start_date, end_date in periods:
+        starts.append(start_date.toordinal())
+        ends.append(end_date.toordinal())
+    starts.sort()
+    ends.sort()
+
+    peak, peak_day, returned = 0, None, 0
+    for index, day in enumerate(starts):
+        # Only periods that started earlier can have ended by now
+        while ends[returned] <= day:
+            returned += 1
+        away = index + 1 - returned
+        if away > peak:
+            peak, peak_day = away, day
+    return peak, date.fromordinal(peak_day) if peak_day else None
+
+
+def find_capacity_conflicts(
+    start_date: date,
+    end_date: date,
+    job_title: str | None = None,
+    threshold: float | None = None,
+) -> list[dict]:
+    """
+    Return the peak number of people away at the same time between the
+    dates for every job title, with the share of the team it represents.
+    Job titles whose share reaches the threshold are flagged as a breach.
+    Approved requests are read with one query and swept per job title.
+    """
+    if threshold is None:
+        threshold = settings.TEAM_CAPACITY_THRESHOLD
+
+    employees = Employee.objects.filter(is_active=True)
+    requests = LeaveRequest.objects.filter(
+        status=StatusRequestChoices.APPROVED,
+        employee__is_active=True,
+        start_date__lte=end_date,
+        end_date__gt=start_date,
+    )
+    if job_title is not None:
+        employees = employees.filter(job_title=job_title)
+        requests = requests.filter(employee__job_title=job_title)
+
+    team_sizes = dict(
+        employees.values("job_title")
+        .annotate(size=Count("pk"))
+        .values_list("job_title", "size")
+    )
+    # The dates of the report are both included
+    report_end = end_date + timedelta(days=1)
+    periods = {}
+    for title, period_start, period_end in requests.values_list(
+        "employee__job_title", "start_date", "end_date"
+    ):
+        periods.setdefault(title, []).append(
+            (max(period_start, start_date), min(period_end, report_end))
+        )
+
+    conflicts = []
+    for title, title_periods in sorted(periods.items()):
+        peak, peak_date = max_concurrent_absences(title_periods)
+        ratio = peak / team_sizes[title]
+        conflicts.append(
+            {
+                "job_title": title,
+                "team_size": team_sizes[title],
+                "peak": peak,
+                "peak_date": peak_date,
+                "ratio": round(ratio, 3),
+                "breach": ratio >= threshold,
+            }
+        )
+    return conflicts
+
+
+def check_leave_request_capacity(leave_request: LeaveRequest) -> dict | None:
+    """
+    Return the capacity of the job title of the employee over the period of
+    the leave request, or None if nobody of the team is away.
+    """
+    conflicts = find_capacity_conflicts(
+        leave_request.start_date,
+        leave_request.end_date,
+        job_title=leave_request.employee.job_title,
+    )
+    return conflicts[0] if conflicts else None
@@ -1,27 +1,44 @@
-from django.db import models
+from django.db import transaction
 from django.db.models.signals import post_save, post_migrate, post_delete
 from django.dispatch import receiver
 
 from common.enums import StatusRequestChoices
-from vacation.models import LeaveRequest, LeaveType, VacationUsed
-
-
-def update_vacation_used(instance=None):
-    if instance.status == StatusRequestChoices.APPROVED:
-        total_days = (
-            LeaveRequest.objects.filter(
-                employee=instance.employee,
-                status=StatusRequestChoices.APPROVED,
-                expired=False,
-            ).aggregate(total=models.Sum("number_of_days"))["total"]
-            or 0
-        )
+from staff.models import DutyRoster
+from vacation.leave_types import invalidate_leave_type_tree
+from vacation.models import LeaveRequest, LeaveType
+from vacation.services import (
+    invalidate_org_dashboard,
+    invalidate_user_dashboard,
+    refresh_employee_availability,
+    refresh_vacation_allowance,
+    update_vacation_balance,
+)
 
-        vacation_used, created = VacationUsed.objects.get_or_create(
-            employee=instance.employee
-        )
-        vacation_used.days = total_days
-        vacation_used.save()
+
+def invalidate_dashboard(instance=None, previous_state=None):
+    """
+    Drop the cached dashboard panels affected by the leave request.
+    The company-wide panels only show approved leave requests, they are
+    dropped when the leave request is or was approved (counted days).
+    """
+    invalidate_user_dashboard(instance.employee_id)
+    was_approved = previous_state is not None and previous_state[1] > 0
+    if was_approved or instance.status == StatusRequestChoices.APPROVED:
+        invalidate_org_dashboard()
+
+
+def refresh_availability(instance, previous_state=None):
+    """Rebuild the absence bitsets touched by the leave request on commit."""
+    employee_ids = {instance.employee_id}
+    years = set(range(instance.start_date.year, instance.end_date.year + 1))
+    if previous_state is not None:
+        (employee_id, year, _leave_type_id), _days = previous_state
+        employee_ids.add(employee_id)
+        # The previous period may have crossed the new year
+        years.update((year, year + 1))
+    transaction.on_commit(
+        lambda: refresh_employee_availability(employee_ids, years)
+    )
 
 
 @receiver(post_migrate)
@@ -34,15 +51,46 @@ def create_default_leave_type(sender, **kwargs):
         sick, _ = LeaveType.objects.get_or_create(title="Sick", parent=None)
         LeaveType.objects.get_or_create(title="Home", parent=sick)
         LeaveType.objects.get_or_create(title="Hospital", parent=sick)
+        # Leave types created before the paths were stored get them here
+        if LeaveType.objects.filter(path="").exists():
+            LeaveType.rebuild_paths()
+            invalidate_leave_type_tree()
 
 
 @receiver(post_delete, sender=LeaveRequest)
 def post_delete_leave_request(sender, instance, **kwargs):
     """Counts the number of used vacation days after deleting the record."""
-    update_vacation_used(instance)
+    previous_state = instance.get_vacation_state()
+    update_vacation_balance(instance, deleted=True)
+    invalidate_dashboard(instance, previous_state)
+    refresh_availability(instance)
 
 
 @receiver(post_save, sender=LeaveRequest)
-def post_save_leave_request(sender, instance, **kwargs):
+def post_save_leave_request(sender, instance, created, **kwargs):
     """Update the number of used vacation days after saving the record."""
-    update_vacation_used(instance)
+    previous_state = None if created else instance.get_vacation_state()
+    update_vacation_balance(instance, created=created)
+    invalidate_dashboard(instance, previous_state)
+    refresh_availability(instance, previous_state)
+
+
+@receiver(post_save, sender=LeaveType)
+def post_save_leave_type(sender, instance, created, **kwargs):
+    """Apply the yearly allowance of the leave type to its open balances."""
+    if not created:
+        refresh_vacation_allowance(instance)
+    transaction.on_commit(invalidate_leave_type_tree)
+
+
+@receiver(post_delete, sender=LeaveType)
+def post_delete_leave_type(sender, instance, **kwargs):
+    """Drop the cached leave type tree after deleting the record."""
+    transaction.on_commit(invalidate_leave_type_tree)
+
+
+@receiver(post_save, sender=DutyRoster)
+@receiver(post_delete, sender=DutyRoster)
+def post_change_duty_roster(sender, instance, **kwargs):
+    """Drop the cached company-wide dashboard when the duty roster changes."""
+    invalidate_org_dashboard()
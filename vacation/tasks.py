@@ -1,54 +1,230 @@
-import asyncio
 import logging
+import time
+from datetime import timedelta
 
 from celery import shared_task
+from celery.signals import worker_process_shutdown
+from django.conf import settings
 from django.db import transaction
+from django.utils import timezone
 
-from common.enums import StatusRequestChoices
-from telegrambot.bot import bot
+from common.enums import (
+    OutboxStatusChoices,
+    RolloverStageChoices,
+    StatusRequestChoices,
+)
+from telegrambot.notifier import (
+    close_notification_sender,
+    get_notification_sender,
+)
 
 logger = logging.getLogger(__name__)
 
+# Notifications still undelivered after this many attempts are dead-lettered
+OUTBOX_MAX_ATTEMPTS = 8
+# Time a dispatcher owns the claimed notifications
+OUTBOX_LEASE = timedelta(minutes=5)
 
-@shared_task
-def reset_vacations_used_days():
-    """Reset the number of days."""
 
-    from vacation.models import VacationUsed, LeaveRequest
+def get_management_chat_ids() -> set[int]:
+    """Return the distinct Telegram ids of the active managers."""
 
-    # Use a transaction to ensure atomicity and integrity
-    with transaction.atomic():
-        # Bulk update to reset all days to 0
-        VacationUsed.objects.all().update(days=0)
-        LeaveRequest.objects.filter(
-            status=StatusRequestChoices.APPROVED
-        ).update(expired=True)
+    from staff.models import Employee
 
-    logger.info("Successfully reset all vacation used days to 0.")
+    # A manager in several groups is returned once per group by the join
+    return set(
+        Employee.objects.filter(
+            telegram_id__isnull=False,
+            is_staff=True,
+            is_active=True,
+            groups__isnull=False,
+        ).values_list("telegram_id", flat=True)
+    )
 
 
 @shared_task
-def send_vacation_request_for_approval(text: str):
-    """Send a vacation request to management for approval"""
+def reset_vacations_used_days(year: int | None = None):
+    """
+    Open the new vacation year.
+    The balances of the new year are created for every active employee and
+    the approved requests of the closed years are marked as expired. Rows
+    are processed in primary key order, one short transaction per chunk, so
+    the database is never locked for long. The position is saved in a
+    checkpoint after every chunk and an interrupted run resumes from it.
+    """
 
     from staff.models import Employee
+    from vacation.models import LeaveRequest, RolloverCheckpoint
+    from vacation.services import open_vacation_year
 
-    managements = Employee.objects.filter(
-        telegram_id__isnull=False,
-        is_staff=True,
-        is_active=True,
-        groups__isnull=False,
-    )
-    if not managements.exists():
-        logger.warning("No active management users found to send message.")
+    year = year or timezone.localdate().year
+    checkpoint, _ = RolloverCheckpoint.objects.get_or_create(year=year)
+    if checkpoint.stage == RolloverStageChoices.DONE:
+        logger.info("Vacation year %s is already open.", year)
         return
 
-    try:
-        loop = asyncio.get_event_loop()
-        tasks = [
-            bot.send_message(chat_id.telegram_id, text)
-            for chat_id in managements
-        ]
-        loop.run_until_complete(asyncio.gather(*tasks))
-    except Exception as e:
-        logger.error("Failed to send message: %s", e)
+    if checkpoint.stage == RolloverStageChoices.BALANCES:
+        _run_rollover_stage(
+            checkpoint,
+            Employee.objects.filter(is_active=True),
+            lambda pks: open_vacation_year(year, pks),
+            next_stage=RolloverStageChoices.EXPIRE,
+        )
+
+    if checkpoint.stage == RolloverStageChoices.EXPIRE:
+        _run_rollover_stage(
+            checkpoint,
+            LeaveRequest.objects.filter(
+                status=StatusRequestChoices.APPROVED,
+                start_date__year__lt=year,
+                expired=False,
+            ),
+            lambda pks: LeaveRequest.objects.filter(pk__in=pks).update(
+                expired=True
+            ),
+            next_stage=RolloverStageChoices.DONE,
+        )
+
+    logger.info("Opened vacation year %s.", year)
+
+
+def _run_rollover_stage(checkpoint, queryset, process, next_stage) -> None:
+    """
+    Process the rows of the queryset after the checkpoint in chunks and
+    move the checkpoint to the next stage once nothing is left.
+    """
+    chunk_size = settings.VACATION_ROLLOVER_CHUNK_SIZE
+    stage = checkpoint.get_stage_display()
+    processed = 0
+    started = time.monotonic()
+
+    while True:
+        pks = list(
+            queryset.filter(pk__gt=checkpoint.last_pk)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:chunk_size]
+        )
+        if not pks:
+            break
+
+        with transaction.atomic():
+            process(pks)
+            checkpoint.last_pk = pks[-1]
+            checkpoint.processed += len(pks)
+            checkpoint.save(
+                update_fields=["last_pk", "processed", "updated_at"]
+            )
+
+        processed += len(pks)
+        logger.info(
+            "Rollover %s, %s: %s rows up to id %s (%.0f rows/s)",
+            checkpoint.year,
+            stage,
+            processed,
+            checkpoint.last_pk,
+            processed / max(time.monotonic() - started, 1e-9),
+        )
+        # Give the web requests waiting for the database lock a chance
+        time.sleep(settings.VACATION_ROLLOVER_PAUSE)
+
+    checkpoint.stage = next_stage
+    checkpoint.last_pk = 0
+    if next_stage == RolloverStageChoices.DONE:
+        checkpoint.finished_at = timezone.now()
+    checkpoint.save()
+
+
+@shared_task
+def dispatch_notification_outbox(batch_size: int = 50) -> dict:
+    """
+    Deliver the pending notifications of the outbox in batches.
+    Delivered notifications are marked as sent, failed ones are retried
+    later with exponential backoff and dead-lettered after
+    OUTBOX_MAX_ATTEMPTS. Delivery is at least once: a notification is only
+    marked as sent after every manager received it.
+    """
+
+    from vacation.models import NotificationOutbox
+
+    counters = {"sent": 0, "retried": 0, "dead": 0}
+    chat_ids = get_management_chat_ids()
+    if not chat_ids:
+        logger.warning("No active management users found to send messages.")
+    else:
+        sender = get_notification_sender()
+        while True:
+            now = timezone.now()
+            due = NotificationOutbox.objects.filter(
+                status=OutboxStatusChoices.PENDING,
+                next_attempt_at__lte=now,
+            )
+            batch = list(due.order_by("pk")[:batch_size])
+            if not batch:
+                break
+
+            # Claim the batch: a row is only kept if this dispatcher moved its
+            # next attempt, a concurrent one that got there first wins it
+            for notification in batch:
+                if due.filter(pk=notification.pk).update(
+                    next_attempt_at=timezone.now() + OUTBOX_LEASE
+                ):
+                    _deliver_notification(
+                        notification, chat_ids, sender, counters
+                    )
+
+            if len(batch) < batch_size:
+                break
+
+    counters["backlog"] = NotificationOutbox.objects.filter(
+        status=OutboxStatusChoices.PENDING
+    ).count()
+    logger.info("Notification outbox dispatched: %s", counters)
+    return counters
+
+
+def _deliver_notification(notification, chat_ids, sender, counters) -> None:
+    """Send one notification and record the outcome."""
+
+    recipients = sorted(chat_ids - set(notification.delivered_to))
+    results = sender.send_many(recipients, notification.text)
+    notification.delivered_to += [
+        result["chat_id"] for result in results if result["delivered"]
+    ]
+    errors = [
+        f"{result['chat_id']}: {result['error']}"
+        for result in results
+        if not result["delivered"]
+    ]
+
+    notification.attempts += 1
+    if not errors:
+        notification.status = OutboxStatusChoices.SENT
+        notification.last_error = None
+        counters["sent"] += 1
+    elif notification.attempts >= OUTBOX_MAX_ATTEMPTS:
+        notification.status = OutboxStatusChoices.DEAD
+        notification.last_error = "\n".join(errors)
+        counters["dead"] += 1
+        logger.error("Notification %s dead-lettered", notification.pk)
+    else:
+        notification.next_attempt_at = timezone.now() + timedelta(
+            minutes=2**notification.attempts
+        )
+        notification.last_error = "\n".join(errors)
+        counters["retried"] += 1
+    notification.save(
+        update_fields=(
+            "status",
+            "attempts",
+            "next_attempt_at",
+            "delivered_to",
+            "last_error",
+            "updated_at",
+        )
+    )
+
+
+@worker_process_shutdown.connect
+def close_bot_session(**kwargs):
+    """Close the bot session and event loop of the worker process."""
+    close_notification_sender()
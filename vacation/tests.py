@@ -1,3 +1,438 @@
-from django.test import TestCase
+import json
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Group
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from common.enums import OutboxStatusChoices, StatusRequestChoices
+from staff.models import DutyRoster, Employee
+from staff.services import make_api_token
+from vacation import tasks
+from vacation.management.commands.import_leave_requests import sweep_overlaps
+from vacation.serializers import (
+    LeaveRequestSubmitSerializer,
+    LeaveRequestUserSerializer,
+)
+from vacation.models import (
+    LeaveRequest,
+    LeaveType,
+    NotificationOutbox,
+    VacationBalance,
+)
+from vacation.services import (
+    _build_org_dashboard_panels,
+    create_leave_request,
+    find_capacity_conflicts,
+    find_overlapping_requests,
+    get_org_dashboard_panels,
+    get_team_availability,
+    invalidate_availability,
+)
+
+
+class OrgDashboardPanelsTests(TestCase):
+    def test_duty_now_is_the_current_weekend_of_the_planned_ones(self):
+        employee = Employee.objects.create(username="duty")
+        first_saturday = date(2026, 10, 17)
+        # Planned ahead like the roster task does, the last row is 07.11
+        for week in range(4):
+            start_date = first_saturday + timedelta(weeks=week)
+            DutyRoster.objects.create(
+                employee=employee,
+                start_date=start_date,
+                end_date=start_date + timedelta(days=1),
+            )
+
+        panels = _build_org_dashboard_panels(date(2026, 10, 17))
+        self.assertEqual(panels["duty_now"].start_date, date(2026, 10, 17))
+
+        panels = _build_org_dashboard_panels(date(2026, 10, 19))
+        self.assertEqual(panels["duty_now"].start_date, date(2026, 10, 24))
+
+    def test_rejecting_an_approved_request_drops_the_cached_panels(self):
+        today = date(2031, 3, 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            leave_request = LeaveRequest.objects.create(
+                employee=Employee.objects.create(username="away"),
+                leave_type=LeaveType.objects.create(title="Away"),
+                start_date=date(2031, 3, 1),
+                end_date=date(2031, 3, 6),
+                status=StatusRequestChoices.APPROVED,
+            )
+        panels = get_org_dashboard_panels(today)
+        self.assertEqual(len(panels["currently_on_leave"]), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            leave_request.status = StatusRequestChoices.REJECTED
+            leave_request.save()
+        panels = get_org_dashboard_panels(today)
+        self.assertEqual(panels["currently_on_leave"], [])
+
+
+class VacationBalanceTests(TransactionTestCase):
+    """Outside of savepoints the balances are changed by deltas."""
+
+    def setUp(self):
+        self.employee = Employee.objects.create(username="balance")
+        self.leave_type = LeaveType.objects.create(title="Balance")
+
+    def used_days(self) -> int:
+        return VacationBalance.objects.get(
+            employee=self.employee, year=2031, leave_type=self.leave_type
+        ).used_days
+
+    def test_stale_instance_applies_the_change_from_the_stored_row(self):
+        leave_request = LeaveRequest.objects.create(
+            employee=self.employee,
+            leave_type=self.leave_type,
+            start_date=date(2031, 3, 1),
+            end_date=date(2031, 3, 6),
+        )
+
+        # Approved through another instance
+        other = LeaveRequest.objects.get(pk=leave_request.pk)
+        other.status = StatusRequestChoices.APPROVED
+        other.save()
+        self.assertEqual(self.used_days(), 5)
+
+        leave_request.refresh_from_db()
+        leave_request.status = StatusRequestChoices.REJECTED
+        leave_request.save()
+        self.assertEqual(self.used_days(), 0)
+
+    def test_stale_instance_without_refresh(self):
+        leave_request = LeaveRequest.objects.create(
+            employee=self.employee,
+            leave_type=self.leave_type,
+            start_date=date(2031, 3, 1),
+            end_date=date(2031, 3, 6),
+            status=StatusRequestChoices.APPROVED,
+        )
+        other = LeaveRequest.objects.get(pk=leave_request.pk)
+        other.status = StatusRequestChoices.REJECTED
+        other.save()
+        self.assertEqual(self.used_days(), 0)
+
+        # Still remembers the approved state, the stored row is rejected
+        leave_request.comment = "Edited"
+        leave_request.status = StatusRequestChoices.APPROVED
+        leave_request.save()
+        self.assertEqual(self.used_days(), 5)
+
+
+class NotificationOutboxTests(TestCase):
+    def setUp(self):
+        manager = Employee.objects.create(
+            username="manager", telegram_id=1, is_staff=True
+        )
+        manager.groups.add(Group.objects.create(name="Managers"))
+        self.sender = mock.Mock()
+        self.sender.send_many.side_effect = lambda chat_ids, text: [
+            {"chat_id": chat_id, "delivered": True} for chat_id in chat_ids
+        ]
+
+    def test_rows_claimed_by_a_concurrent_dispatcher_are_skipped(self):
+        first = NotificationOutbox.objects.create(text="First")
+        second = NotificationOutbox.objects.create(text="Second")
+        deliver = tasks._deliver_notification
+
+        def deliver_and_race(notification, *args):
+            # Another dispatcher claims the second row meanwhile
+            NotificationOutbox.objects.filter(pk=second.pk).update(
+                next_attempt_at=timezone.now() + tasks.OUTBOX_LEASE
+            )
+            deliver(notification, *args)
+
+        with mock.patch.object(
+            tasks, "get_notification_sender", return_value=self.sender
+        ), mock.patch.object(
+            tasks, "_deliver_notification", side_effect=deliver_and_race
+        ):
+            counters = tasks.dispatch_notification_outbox()
+
+        self.assertEqual(counters["sent"], 1)
+        self.sender.send_many.assert_called_once_with([1], "First")
+        first.refresh_from_db()
+        self.assertEqual(first.status, OutboxStatusChoices.SENT)
+
+    def test_submitting_survives_a_broker_outage(self):
+        leave_request = LeaveRequest.objects.create(
+            employee=Employee.objects.create(username="requester"),
+            leave_type=LeaveType.objects.create(title="Outage"),
+            start_date=date(2031, 3, 1),
+            end_date=date(2031, 3, 6),
+        )
+
+        def broker_down():
+            raise ConnectionError("Broker is down")
+
+        with mock.patch.object(
+            tasks.dispatch_notification_outbox, "delay", broker_down
+        ), self.captureOnCommitCallbacks(execute=True):
+            leave_request.submit_for_approval()
+
+        self.assertTrue(
+            NotificationOutbox.objects.filter(
+                leave_request=leave_request,
+                status=OutboxStatusChoices.PENDING,
+            ).exists()
+        )
+
+
+class CreateLeaveRequestTests(TestCase):
+    def setUp(self):
+        self.employee = Employee.objects.create(username="creator")
+        self.data = {
+            "leave_type": LeaveType.objects.create(title="Create").pk,
+            "start_date": "2031-03-01",
+            "end_date": "2031-03-06",
+            "idempotency_key": "42:7",
+        }
+
+    def create(self, serializer_class, submit=False, **data):
+        return create_leave_request(
+            serializer_class(
+                data={**self.data, **data},
+                context={"employee": self.employee},
+            ),
+            self.employee.pk,
+            submit=submit,
+        )
+
+    def test_past_period_is_rejected(self):
+        with self.assertRaises(ValidationError) as error:
+            self.create(LeaveRequestUserSerializer, start_date="2020-03-01")
+        self.assertIn("status", error.exception.detail)
+        self.assertFalse(LeaveRequest.objects.exists())
+
+    def test_submit_is_replayed_by_the_idempotency_key(self):
+        with self.captureOnCommitCallbacks():
+            leave_request, created = self.create(
+                LeaveRequestSubmitSerializer, submit=True
+            )
+            replayed, replay_created = self.create(
+                LeaveRequestSubmitSerializer, submit=True
+            )
+
+        self.assertTrue(created)
+        self.assertEqual(leave_request.status, StatusRequestChoices.PENDING)
+        self.assertEqual((replayed, replay_created), (leave_request, False))
+        self.assertEqual(NotificationOutbox.objects.count(), 1)
+
+
+class LeaveRequestApiTests(TestCase):
+    def setUp(self):
+        employee = Employee.objects.create(username="lister")
+        leave_type = LeaveType.objects.create(title="Listed")
+        self.leave_requests = [
+            LeaveRequest.objects.create(
+                employee=employee,
+                leave_type=leave_type,
+                start_date=date(2031, month, 1),
+                end_date=date(2031, month, 6),
+            )
+            for month in (3, 4)
+        ]
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {make_api_token(employee.pk)}"
+        )
+
+    def test_if_modified_since_sees_a_deleted_row(self):
+        response = self.client.get("/api/leave-requests/")
+        last_modified = response["Last-Modified"]
+
+        response = self.client.get(
+            "/api/leave-requests/", HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # The latest modification time stays the one of the other row
+        self.leave_requests[0].delete()
+        response = self.client.get(
+            "/api/leave-requests/", HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 1)
+
+    def test_changes_cursor_lags_behind_the_recent_changes(self):
+        response = self.client.get("/api/leave-requests/changes/")
+        self.assertEqual(len(response.data["changed"]), 2)
+
+        # Changes committed late within the lag are returned again
+        response = self.client.get(
+            "/api/leave-requests/changes/",
+            {"since": response.data["cursor"]},
+        )
+        self.assertEqual(len(response.data["changed"]), 2)
+
+
+class TeamAvailabilityTests(TestCase):
+    def setUp(self):
+        invalidate_availability()
+        self.employee = Employee.objects.create(username="available")
+        self.leave_type = LeaveType.objects.create(title="Available")
+
+    def approve(
+        self, start_date: date, end_date: date, employee=None
+    ) -> LeaveRequest:
+        with self.captureOnCommitCallbacks(execute=True):
+            return LeaveRequest.objects.create(
+                employee=employee or self.employee,
+                leave_type=self.leave_type,
+                start_date=start_date,
+                end_date=end_date,
+                status=StatusRequestChoices.APPROVED,
+            )
+
+    def test_the_end_date_is_not_an_absent_day(self):
+        leave_request = self.approve(date(2031, 3, 2), date(2031, 3, 6))
+
+        availability = get_team_availability(
+            date(2031, 3, 1), date(2031, 3, 7)
+        )
+        self.assertEqual(availability["absent"], [0, 1, 1, 1, 1, 0, 0])
+        self.assertEqual(
+            availability["absences"][0]["days"], leave_request.number_of_days
+        )
+
+    def test_a_leave_across_the_new_year(self):
+        leave_request = self.approve(date(2031, 12, 30), date(2032, 1, 2))
+
+        availability = get_team_availability(
+            date(2031, 12, 29), date(2032, 1, 2)
+        )
+        self.assertEqual(availability["absent"], [0, 1, 1, 1, 0])
+        self.assertEqual(leave_request.number_of_days, 3)
+
+    def test_back_to_back_leaves_do_not_overlap(self):
+        self.employee.job_title = "dev"
+        self.employee.save()
+        colleague = Employee.objects.create(username="back", job_title="dev")
+        self.approve(date(2031, 3, 1), date(2031, 3, 5))
+        self.approve(date(2031, 3, 5), date(2031, 3, 9), employee=colleague)
+
+        availability = get_team_availability(
+            date(2031, 3, 1), date(2031, 3, 9)
+        )
+        self.assertEqual(max(availability["absent"]), 1)
+        [capacity] = find_capacity_conflicts(
+            date(2031, 3, 1), date(2031, 3, 9), job_title="dev"
+        )
+        self.assertEqual((capacity["peak"], capacity["ratio"]), (1, 0.5))
+
+    def test_capacity_counts_the_last_day_of_the_report(self):
+        self.employee.job_title = "dev"
+        self.employee.save()
+        self.approve(date(2031, 3, 9), date(2031, 3, 12))
+
+        [capacity] = find_capacity_conflicts(
+            date(2031, 3, 1), date(2031, 3, 9), job_title="dev"
+        )
+        self.assertEqual(
+            (capacity["peak"], capacity["peak_date"]), (1, date(2031, 3, 9))
+        )
+
+
+class SweepOverlapsTests(SimpleTestCase):
+    def test_candidate_rejected_by_an_existing_period_frees_the_others(self):
+        self.assertEqual(sweep_overlaps([(5, 6)], [(1, 10), (3, 4)]), {0})
+
+    def test_candidates_overlapping_each_other_keep_the_earliest(self):
+        self.assertEqual(
+            sweep_overlaps([], [(4, 8), (1, 3), (2, 5), (9, 9)]), {2}
+        )
+
+    def test_existing_periods_are_merged(self):
+        existing = [(10, 12), (1, 3), (2, 8)]
+        candidates = [(9, 10), (7, 9), (13, 20), (0, 2), (12, 14)]
+        self.assertEqual(sweep_overlaps(existing, candidates), {1, 2, 3})
+
+    def test_the_end_date_is_the_return_day(self):
+        self.assertEqual(sweep_overlaps([(1, 3)], [(3, 4), (2, 3)]), {1})
+        self.assertEqual(sweep_overlaps([], [(1, 3), (3, 4)]), set())
+
+
+class FindOverlappingRequestsTests(TestCase):
+    def test_a_leave_starting_on_the_return_day_does_not_overlap(self):
+        employee = Employee.objects.create(username="overlap")
+        leave_request = LeaveRequest.objects.create(
+            employee=employee,
+            leave_type=LeaveType.objects.create(title="Overlap"),
+            start_date=date(2031, 3, 1),
+            end_date=date(2031, 3, 5),
+        )
+
+        self.assertEqual(
+            find_overlapping_requests(
+                employee, date(2031, 3, 5), date(2031, 3, 9)
+            ),
+            [],
+        )
+        self.assertEqual(
+            find_overlapping_requests(
+                employee, date(2031, 3, 4), date(2031, 3, 9)
+            ),
+            [leave_request],
+        )
+        self.assertEqual(
+            find_overlapping_requests(
+                employee, date(2031, 2, 25), date(2031, 3, 1)
+            ),
+            [],
+        )
+
+
+class SparseFieldsetsTests(TestCase):
+    def setUp(self):
+        self.leave_request = LeaveRequest.objects.create(
+            employee=Employee.objects.create(username="sparse"),
+            leave_type=LeaveType.objects.create(title="Sparse"),
+            start_date=date(2031, 3, 1),
+            end_date=date(2031, 3, 6),
+        )
+        self.factory = APIRequestFactory()
+
+    def serialize(self, request=None, **context) -> dict:
+        if request is not None:
+            context["request"] = Request(request, parsers=[JSONParser()])
+        return LeaveRequestUserSerializer(
+            self.leave_request, context=context
+        ).data
+
+    def test_fields_from_the_query_string(self):
+        data = self.serialize(
+            self.factory.get("/", {"fields": "id, start_date,unknown"})
+        )
+        self.assertEqual(set(data), {"id", "start_date"})
+
+    def test_fields_from_the_body_of_a_bot_request(self):
+        data = self.serialize(
+            self.factory.generic(
+                "GET",
+                "/",
+                json.dumps({"fields": ["id", "status"]}),
+                content_type="application/json",
+            )
+        )
+        self.assertEqual(set(data), {"id", "status"})
+
+    def test_fields_from_the_context_without_a_request(self):
+        self.assertEqual(set(self.serialize(fields="id")), {"id"})
+
+    def test_writes_and_plain_reads_keep_every_field(self):
+        every_field = set(self.serialize())
+        self.assertIn("end_date", every_field)
+        self.assertEqual(
+            set(self.serialize(self.factory.post("/?fields=id"))),
+            every_field,
+        )
+        self.assertEqual(
+            set(self.serialize(self.factory.get("/"))), every_field
+        )
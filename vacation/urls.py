@@ -10,6 +10,8 @@ from vacation.views import (
     LeaveRequestDeleteView,
     LeaveRequestUserViewSet,
     LeaveTypeViewSet,
+    TeamAvailabilityViewSet,
+    TeamCapacityViewSet,
 )
 
 router = DefaultRouter()
@@ -17,6 +19,10 @@ router.register(
     r"leave-requests", LeaveRequestUserViewSet, basename="leave-request"
 )
 router.register(r"leave-type", LeaveTypeViewSet, basename="leave-type")
+router.register(
+    r"availability", TeamAvailabilityViewSet, basename="availability"
+)
+router.register(r"capacity", TeamCapacityViewSet, basename="capacity")
 
 urlpatterns = [
     path("", DashBoardView.as_view(), name="dashboard"),
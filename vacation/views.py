@@ -1,7 +1,8 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.messages.views import SuccessMessageMixin
-from django.db.models import Q, Count, Sum, Value, CharField, F
-from django.db.models.functions import Concat
 from django.shortcuts import redirect
 from django.urls import reverse_lazy
 from django.utils import timezone
@@ -17,32 +18,57 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.utils.translation import gettext_lazy as _
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.permissions import (
     BasePermission,
+    IsAdminUser,
     IsAuthenticatedOrReadOnly,
 )
 from rest_framework.response import Response
 
 from common.enums import StatusRequestChoices
 from common.env import env
-from staff.models import DutyRoster, Employee
+from common.mixins import ConditionalListMixin
+from staff.models import Employee
 from staff.services import check_telegram_auth
-from vacation.models import LeaveRequest, VacationUsed, LeaveType
+from vacation.models import LeaveRequest
 from vacation.forms import LeaveRequestForm
+from vacation.pagination import LeaveRequestCursorPagination
 from vacation.serializers import (
+    LeaveRequestChangesQuerySerializer,
+    LeaveRequestSubmitSerializer,
     LeaveRequestUserSerializer,
+    TeamAvailabilityQuerySerializer,
+    TeamCapacityQuerySerializer,
     VacationLeaveTypeSerializer,
 )
+from vacation.services import (
+    create_leave_request,
+    describe_overlapping_requests,
+    find_capacity_conflicts,
+    get_org_dashboard_panels,
+    get_requestable_leave_types,
+    get_team_availability,
+    get_used_vacation_days,
+    get_user_dashboard_panels,
+    get_user_leave_requests,
+    is_telegram_employee,
+    submit_leave_request,
+)
 
 
 class UserLeaveRequestMixin(LoginRequiredMixin):
     """Mixin to filter leave requests by the current user."""
 
     def get_queryset(self):
-        return LeaveRequest.objects.filter(
-            employee=self.request.user,
-            expired=False,
-        ).order_by("-created_at")
+        return (
+            LeaveRequest.objects.filter(
+                employee=self.request.user,
+                expired=False,
+            )
+            .select_related("leave_type__parent")
+            .order_by("-created_at")
+        )
 
 
 class DashBoardView(LoginRequiredMixin, TemplateView):
@@ -57,80 +83,11 @@ class DashBoardView(LoginRequiredMixin, TemplateView):
         today = timezone.now().date()
         context["current_date"] = today
 
-        # Upcoming Leave
-        upcoming_leaves = LeaveRequest.objects.filter(
-            employee=self.request.user,
-            start_date__gt=today,
-            status=StatusRequestChoices.APPROVED,
-        )
-        context["upcoming_leaves"] = upcoming_leaves
+        # Company-wide panels (people on leave, current duty)
+        context.update(get_org_dashboard_panels(today))
 
-        # Currently on vacation
-        currently_on_leave = LeaveRequest.objects.filter(
-            start_date__lte=today,
-            end_date__gte=today,
-            status=StatusRequestChoices.APPROVED,
-        )
-        context["currently_on_leave"] = currently_on_leave
-
-        # Current user on leave
-        current_user_on_leave = LeaveRequest.objects.filter(
-            employee=self.request.user,
-            start_date__lte=today,
-            end_date__gte=today,
-            status=StatusRequestChoices.APPROVED,
-        ).last()
-        context["current_user_on_leave"] = current_user_on_leave
-
-        # User's last vacation
-        user_last_vacation = (
-            LeaveRequest.objects.filter(
-                employee=self.request.user,
-                end_date__lte=today,
-                status=StatusRequestChoices.APPROVED,
-            )
-            .order_by("-end_date")
-            .first()
-        )
-        context["user_last_vacation"] = user_last_vacation
-
-        # Current duty
-        duty_now = (
-            DutyRoster.objects.filter(end_date__gte=today)
-            .order_by("pk")
-            .last()
-        )
-        context["duty_now"] = duty_now if duty_now else None
-
-        # Calculate the total number of days for each type of vacation
-        leave_type_days_summary = (
-            LeaveRequest.objects.filter(
-                employee=self.request.user,
-                status=StatusRequestChoices.APPROVED,
-                expired=False,
-            )
-            .values(
-                "leave_type__title",
-                "leave_type__parent__title",
-                "leave_type__pk",
-            )
-            .annotate(
-                total_days=Sum("number_of_days"),
-                full_title=Concat(
-                    "leave_type__parent__title",
-                    Value(" - "),
-                    "leave_type__title",
-                    output_field=CharField(),
-                ),
-                pk=F("leave_type__pk"),
-            )
-            .order_by("leave_type_id")
-        )
-        # Replace the full_title value if leave_type has no parent
-        for summary in leave_type_days_summary:
-            if summary["leave_type__parent__title"] is None:
-                summary["full_title"] = summary["leave_type__title"]
-        context["leave_type_days_summary"] = leave_type_days_summary
+        # Panels of the current user
+        context.update(get_user_dashboard_panels(self.request.user, today))
         return context
 
 
@@ -152,12 +109,10 @@ class LeaveRequestDetailView(UserLeaveRequestMixin, DetailView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["saved"] = StatusRequestChoices.SAVED
-        leave_request = self.get_object()
-        employee = leave_request.employee
-        vacation_days_used = (
-            VacationUsed.objects.get(employee=employee).days or 0
+        leave_request = self.object
+        context["vacation_days_used"] = get_used_vacation_days(
+            leave_request.employee_id, leave_request.start_date.year
         )
-        context["vacation_days_used"] = vacation_days_used
         return context
 
 
@@ -172,11 +127,8 @@ class LeaveRequestFormMixin(UserLeaveRequestMixin):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        vacation_used = VacationUsed.objects.filter(
-            employee=self.request.user
-        ).first()
-        context["vacation_days_used"] = (
-            vacation_used.days if vacation_used else 0
+        context["vacation_days_used"] = get_used_vacation_days(
+            self.request.user, timezone.localdate().year
         )
         return context
 
@@ -253,41 +205,72 @@ class IsTelegramUserId(BasePermission):
         )
 
 
-class LeaveTypeViewSet(viewsets.ModelViewSet):
+class LeaveTypeViewSet(ConditionalListMixin, viewsets.ModelViewSet):
     serializer_class = VacationLeaveTypeSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    # The title of a subtype includes the title of its parent
+    last_modified_fields = ("updated_at", "parent__updated_at")
 
     def get_queryset(self):
-        """
-        Get all LeaveTypes with an additional subtypes_count field.
-        Only those LeaveTypes that have a parent or no subtypes are returned.
-        """
-        try:
-            queryset = LeaveType.objects.annotate(
-                subtypes_count=Count("subtypes")
-            )
-            filtered_queryset = queryset.filter(
-                Q(parent__isnull=False)
-                | Q(parent__isnull=True, subtypes_count=0)
+        """Get the LeaveTypes that can be requested."""
+        return get_requestable_leave_types()
+
+
+class TeamAvailabilityViewSet(viewsets.ViewSet):
+    """
+    Who is out between two dates.
+    Returns a per-day bitmap of every absent employee and the daily
+    headcounts for ?start_date=YYYY-MM-DD&end_date=YYYY-MM-DD.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def list(self, request):
+        serializer = TeamAvailabilityQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(
+            get_team_availability(
+                serializer.validated_data["start_date"],
+                serializer.validated_data["end_date"],
             )
-            return filtered_queryset
-        except LeaveType.DoesNotExist:
-            return LeaveType.objects.none()
+        )
+
+
+class TeamCapacityViewSet(viewsets.ViewSet):
+    """
+    Peak number of people away at the same time per job title for
+    ?start_date=YYYY-MM-DD&end_date=YYYY-MM-DD, optionally filtered by
+    &job_title= and checked against &threshold= (a share from 0 to 1).
+    """
 
+    permission_classes = [IsAdminUser]
 
-class LeaveRequestUserViewSet(viewsets.ModelViewSet):
+    def list(self, request):
+        serializer = TeamCapacityQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(find_capacity_conflicts(**serializer.validated_data))
+
+
+class LeaveRequestUserViewSet(ConditionalListMixin, viewsets.ModelViewSet):
     serializer_class = LeaveRequestUserSerializer
     permission_classes = [IsTelegramUserId]
+    pagination_class = LeaveRequestCursorPagination
 
     def get_request_user(self) -> Employee | None:
         """
-        Returns the Employee object corresponding to the provided telegram_id
-        if it exists, otherwise returns the authenticated User.
+        Returns the authenticated User (an API token resolves to the employee
+        without a query), otherwise the Employee object corresponding to the
+        provided telegram_id if the payload is signed.
+        The result is memoized for the request.
         """
+        if not hasattr(self, "_request_user"):
+            self._request_user = self._get_request_user()
+        return self._request_user
+
+    def _get_request_user(self) -> Employee | None:
+        if self.request.user.is_authenticated:
+            return self.request.user
 
-        user = (
-            self.request.user if self.request.user.is_authenticated else None
-        )
         telegram_id = self.request.data.get("telegram_id")
         auth_date = self.request.data.get("auth_date")
         hash_data = self.request.data.get("hash")
@@ -295,64 +278,47 @@ class LeaveRequestUserViewSet(viewsets.ModelViewSet):
         if telegram_id and auth_date and hash_data:
             if check_telegram_auth(self.request.data, env.str("BOT_TOKEN")):
                 try:
-                    user = Employee.objects.get(telegram_id=telegram_id)
-                    return user
+                    # Like the token exchange, only for active employees
+                    return Employee.objects.get(
+                        telegram_id=telegram_id, is_active=True
+                    )
                 except Employee.DoesNotExist:
                     return None
-        return user
+        return None
 
     def get_queryset(self):
         request_user = self.get_request_user()
 
-        if not request_user:
+        if request_user is None:
             # Return an empty queryset if no user is found
             return LeaveRequest.objects.none()
 
-        return LeaveRequest.objects.filter(
-            employee=request_user, expired=False
-        )
+        return get_user_leave_requests(request_user.pk)
+
+    def get_serializer_context(self):
+        # The overlap validation needs the employee of the bot requests too
+        return {
+            **super().get_serializer_context(),
+            "employee": self.get_request_user(),
+        }
 
     def create(self, request, *args, **kwargs):
         """Handle the creation of a new vacation record with validation."""
 
-        serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        validated_data = serializer.validated_data
-
-        # Check if start_date is in the past
-        start_date = validated_data.get("start_date", "0000-00-00")
-        if start_date < timezone.now().date():
-            return Response(
-                {
-                    "status": _(
-                        "Start date cannot be earlier than the current date."
-                    )
-                },
-                status=status.HTTP_400_BAD_REQUEST,
-            )
+        request_user = self.get_request_user()
+        if request_user is None:
+            raise PermissionDenied(_("Employee not found."))
 
-        # Check if start_date is after end_date
-        end_date = validated_data.get("end_date", "0000-00-00")
-        if start_date >= end_date:
-            return Response(
-                {
-                    "status": _(
-                        "Start date cannot be later than or equal to end date."
-                    )
-                },
-                status=status.HTTP_400_BAD_REQUEST,
-            )
-        self.perform_create(serializer)
-        headers = self.get_success_headers(serializer.data)
+        leave_request, _created = create_leave_request(
+            self.get_serializer(data=request.data), request_user.pk
+        )
+        data = self.get_serializer(leave_request).data
         return Response(
-            serializer.data, status=status.HTTP_201_CREATED, headers=headers
+            data,
+            status=status.HTTP_201_CREATED,
+            headers=self.get_success_headers(data),
         )
 
-    def perform_create(self, serializer):
-        """Save the new vacation record with the current user as the employee."""
-
-        serializer.save(employee=self.get_request_user())
-
     def perform_update(self, serializer):
         if (
             "status" in serializer.validated_data
@@ -384,10 +350,12 @@ class LeaveRequestUserViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=["get"])
     def vacation_days_used(self, request):
-        vacation_used = VacationUsed.objects.filter(
-            employee=self.get_request_user()
-        ).first()
-        days_used = vacation_used.days if vacation_used else 0
+        request_user = self.get_request_user()
+        days_used = (
+            get_used_vacation_days(request_user.pk, timezone.localdate().year)
+            if request_user is not None
+            else 0
+        )
         return Response({"vacation_days_used": days_used})
 
     @action(detail=False, methods=["get"])
@@ -401,12 +369,67 @@ class LeaveRequestUserViewSet(viewsets.ModelViewSet):
                 status=400,
             )
 
-        # Filter employees by telegram_id
-        employees = Employee.objects.filter(telegram_id=telegram_id)
+        return Response({"status": is_telegram_employee(telegram_id)})
 
-        if employees.exists():
-            return Response({"status": True})
-        return Response({"status": False})
+    @action(detail=False, methods=["get"])
+    def changes(self, request):
+        """
+        Return the leave requests changed and the ids of the ones deleted
+        after the `since` cursor, with the cursor to send next time.
+        Without a cursor every leave request of the user is returned.
+        The cursor stays CHANGES_CURSOR_LAG seconds behind the current time,
+        so the changes of the last seconds are returned again next time:
+        clients apply them by id.
+        """
+        query = LeaveRequestChangesQuerySerializer(
+            data=request.query_params or request.data
+        )
+        query.is_valid(raise_exception=True)
+        since = query.validated_data.get("since")
+
+        request_user = self.get_request_user()
+        if request_user is None:
+            return Response(
+                {"detail": _("Employee not found.")},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        changed = (
+            LeaveRequest.objects.filter(employee_id=request_user.pk)
+            .select_related("employee", "leave_type__parent")
+            .order_by("updated_at", "id")
+        )
+        deleted = LeaveRequest.history.filter(
+            employee_id=request_user.pk, history_type="-"
+        ).order_by("history_date")
+        if since is not None:
+            changed = changed.filter(updated_at__gt=since)
+            deleted = deleted.filter(history_date__gt=since)
+        changed = list(changed)
+        deleted = list(deleted.values_list("id", "history_date"))
+
+        timestamps = [leave_request.updated_at for leave_request in changed]
+        timestamps += [history_date for _pk, history_date in deleted]
+        # A transaction still open may commit a change timestamped before
+        # the newest one seen here, the cursor never passes the lag
+        lagged = timezone.now() - timedelta(
+            seconds=settings.CHANGES_CURSOR_LAG
+        )
+        timestamps = [min(timestamp, lagged) for timestamp in timestamps]
+        if since is not None:
+            timestamps.append(since)
+        cursor = max(timestamps, default=None)
+        return Response(
+            {
+                "changed": self.get_serializer(changed, many=True).data,
+                "deleted": [pk for pk, _history_date in deleted],
+                "cursor": (
+                    query.fields["since"].to_representation(cursor)
+                    if cursor
+                    else None
+                ),
+            }
+        )
 
     @action(detail=False, methods=["get"])
     def check_overlap(self, request):
@@ -414,27 +437,42 @@ class LeaveRequestUserViewSet(viewsets.ModelViewSet):
         start_date = request.data.get("start_date")
         end_date = request.data.get("end_date")
 
-        overlapping_requests = LeaveRequest.objects.filter(
-            employee__telegram_id=telegram_id,
-            start_date__lte=end_date,
-            end_date__gte=start_date,
-        )
-        overlap = overlapping_requests.exists()
-        overlapping_dates = (
-            ",\n".join(
-                f"#{req.pk}: {req.start_date} - {req.end_date}"
-                for req in overlapping_requests
+        return Response(
+            describe_overlapping_requests(
+                Employee.objects.filter(telegram_id=telegram_id).values("pk")[
+                    :1
+                ],
+                start_date,
+                end_date,
             )
-            if overlap
-            else None
+        )
+
+    @action(
+        detail=False,
+        methods=["post"],
+        serializer_class=LeaveRequestSubmitSerializer,
+    )
+    def submit(self, request):
+        """
+        Create a leave request already submitted for approval in one atomic
+        call. A request repeating the `idempotency_key` of an earlier one
+        returns the leave request created then (200 instead of 201).
+        """
+        request_user = self.get_request_user()
+        if request_user is None:
+            raise PermissionDenied(_("Employee not found."))
+
+        leave_request, created = create_leave_request(
+            self.get_serializer(data=request.data),
+            request_user.pk,
+            submit=True,
         )
         return Response(
-            {"overlap": overlap, "leave_request": overlapping_dates}
+            self.get_serializer(leave_request).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
         )
 
     @action(detail=True, methods=["post"])
     def save_and_submit(self, request, pk=None):
-        leave_request = self.get_object()
-        leave_request.submit_for_approval()
-        leave_request.save()
+        submit_leave_request(self.get_object())
         return Response({"status": _("Leave request submitted for approval")})